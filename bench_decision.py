@@ -0,0 +1,282 @@
+"""
+Micro-benchmarks of the decision logic on synthetic input streams.
+
+Every case feeds one piece of the decision path main.py runs a seeded stream
+of synthetic inputs (slopes from straight lines to sharp curves and lost
+lines, 0 to MAX_BOXES rescue boxes of random classes, green mark layouts on
+either side of the line moving down the image) and reports the cost per call
+and a digest of all outputs. Save a baseline on one commit and compare on
+another to see speed changes and any change of behavior:
+
+  python bench_decision.py --save bin/bench_decision.json
+  python bench_decision.py --compare bin/bench_decision.json
+
+The compare run exits with 1 when an output digest changed. Timings are the
+best of --repeat runs but still vary between runs, so cases slower than
+TIME_REGRESSION_RATIO are only flagged as advisory and never fail the run.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import sys
+import time
+from typing import Callable, Optional
+
+import decision
+from green_fusion import GreenMarkFusion
+from steering import SteeringController
+
+LINETRACE_IMAGE_WIDTH = 160
+LINETRACE_IMAGE_HEIGHT = 120
+RESCUE_IMAGE_WIDTH = 1280
+RESCUE_IMAGE_HEIGHT = 720
+CAMERA_FPS = 30
+MAX_BOXES = 12
+MAX_MARKS = 4
+COMPUTING_P = 400
+DEFAULT_SPEED = 1700
+P = 0.4
+AP = 1
+WP = 0.3
+BALL_CATCH_SIZE = 140000
+TIME_REGRESSION_RATIO = 2.0  # Slower than this times the baseline is flagged
+DEFAULT_REPEAT = 15
+
+
+def synthetic_slope(rng: random.Random) -> Optional[float]:
+  """Line slope of a straight, curved, sharp or lost line."""
+  kind = rng.random()
+  if kind < 0.05:
+    return None
+  if kind < 0.45:
+    theta = math.pi / 2 + rng.gauss(0, 0.05)
+  elif kind < 0.85:
+    theta = rng.uniform(0.3, math.pi - 0.3)
+  else:
+    theta = rng.choice((rng.uniform(0.01, 0.3), rng.uniform(math.pi - 0.3,
+                                                             math.pi - 0.01)))
+  return math.tan(theta)
+
+
+def synthetic_boxes(
+    rng: random.Random) -> list[tuple[int, float, float, float, float]]:
+  """YOLO boxes (cls, x_center, y_center, w, h) of one rescue frame."""
+  count = min(MAX_BOXES, int(rng.expovariate(0.4)))
+  boxes = []
+  for _ in range(count):
+    w = rng.uniform(20, 500)
+    h = rng.uniform(20, 500)
+    boxes.append((rng.randrange(5), rng.uniform(0, RESCUE_IMAGE_WIDTH),
+                  rng.uniform(0, RESCUE_IMAGE_HEIGHT), w, h))
+  return boxes
+
+
+def synthetic_marks(
+    rng: random.Random,
+    y: Optional[float] = None) -> tuple[list[list[float]], list[list[int]]]:
+  """
+    Green marks and their black line checks of one line trace frame.
+
+    Args:
+        rng: Random source
+        y: Image row of the marks, random when None
+
+    Returns:
+        tuple: green_marks and green_black_detected
+    """
+  count = min(MAX_MARKS, int(rng.expovariate(1.0)))
+  layouts = ((0, 1, 1, 0), (0, 1, 0, 1), (0, 1, 1, 1), (1, 1, 1, 0),
+             (0, 0, 0, 1), (0, 1, 0, 0))
+  marks = []
+  detections = []
+  for _ in range(count):
+    mark_y = rng.uniform(0, LINETRACE_IMAGE_HEIGHT) if y is None else y
+    marks.append([
+        rng.uniform(0, LINETRACE_IMAGE_WIDTH), mark_y,
+        rng.uniform(10, 40),
+        rng.uniform(10, 40)
+    ])
+    detections.append(list(rng.choice(layouts)))
+  return marks, detections
+
+
+def build_inputs(n: int, seed: int) -> dict:
+  """All synthetic streams, n frames each."""
+  rng = random.Random(seed)
+  slopes = [synthetic_slope(rng) for _ in range(n)]
+  rescue = [
+      decision.RescueSnapshot(synthetic_boxes(rng), RESCUE_IMAGE_WIDTH,
+                              RESCUE_IMAGE_HEIGHT,
+                              [rng.choice((0, 2, 3, 4))], rng.random() < 0.3)
+      for _ in range(n)
+  ]
+  # Marks moving down the image like at an intersection, for the fusion
+  fusion_frames = []
+  y = 0.0
+  t = 0.0
+  for _ in range(n):
+    y = 0.0 if y > LINETRACE_IMAGE_HEIGHT else y + rng.uniform(2, 8)
+    t += 1 / CAMERA_FPS
+    green_marks, green_black_detected = synthetic_marks(rng, y)
+    fusion_frames.append((t, green_marks, green_black_detected))
+  return {
+      "t": [i / CAMERA_FPS for i in range(n)],
+      "slopes": slopes,
+      "theta": [rng.uniform(-math.pi / 2, math.pi / 2) for _ in range(n)],
+      "values": [rng.uniform(500, 2500) for _ in range(n)],
+      "linetrace": [
+          decision.LinetraceSnapshot(t, slope, green_marks,
+                                     green_black_detected)
+          for slope, (t, green_marks, green_black_detected) in zip(
+              slopes, fusion_frames)
+      ],
+      "rescue": rescue,
+      "fusion": fusion_frames,
+  }
+
+
+def make_cases(inputs: dict) -> dict[str, tuple[list, Callable]]:
+  """
+    Benchmark cases as name -> (input stream, factory of the call).
+
+    The factory is called once per repeat so stateful cases start fresh.
+    """
+
+  def make_steering():
+    return SteeringController(COMPUTING_P, 0.0, 10.0, 0.05, DEFAULT_SPEED)
+
+  def steering():
+    controller = make_steering()
+    return lambda frame: controller.update(frame[1], frame[0])
+
+  def fusion():
+    fused = GreenMarkFusion(LINETRACE_IMAGE_HEIGHT)
+    return lambda frame: fused.update(*frame)
+
+  def linetrace():
+    controller = make_steering()
+    fused = GreenMarkFusion(LINETRACE_IMAGE_HEIGHT)
+    return lambda snapshot: decision.decide_linetrace(snapshot, controller,
+                                                      fused)
+
+  return {
+      "fix_to_range": (inputs["values"], lambda: lambda x: decision.
+                       fix_to_range(x, decision.MOTOR_MIN, decision.MOTOR_MAX)),
+      "compute_moving_value":
+          (inputs["theta"],
+           lambda: lambda theta: decision.compute_moving_value(
+               theta, COMPUTING_P)),
+      "compute_default_speed":
+          (inputs["slopes"],
+           lambda: lambda slope: decision.compute_default_speed(
+               slope, DEFAULT_SPEED)),
+      "find_best_target":
+          (inputs["rescue"],
+           lambda: lambda snapshot: decision.find_best_target(
+               snapshot.boxes, snapshot.image_width, snapshot.valid_classes,
+               snapshot.is_ball_caching)),
+      "decide_linetrace": (inputs["linetrace"], linetrace),
+      "decide_rescue": (inputs["rescue"], lambda: lambda snapshot: decision.
+                        decide_rescue(snapshot, P, AP, WP, BALL_CATCH_SIZE)),
+      "SteeringController.update":
+          (list(zip(inputs["t"], inputs["slopes"])), steering),
+      "GreenMarkFusion.update": (inputs["fusion"], fusion),
+  }
+
+
+def run_case(stream: list, factory: Callable, repeat: int) -> dict:
+  """
+    Time one case and digest its outputs.
+
+    Returns:
+        dict: calls, ns_per_call (best of repeat, loop overhead included)
+            and digest of the outputs of the first run
+    """
+  call = factory()
+  digest = hashlib.sha256(repr([call(x) for x in stream]).encode()).hexdigest()
+  best = float("inf")
+  for _ in range(repeat):
+    call = factory()
+    start = time.perf_counter_ns()
+    for x in stream:
+      call(x)
+    best = min(best, time.perf_counter_ns() - start)
+  return {
+      "calls": len(stream),
+      "ns_per_call": best / max(1, len(stream)),
+      "digest": digest[:16],
+  }
+
+
+def compare(results: dict, baseline: dict) -> tuple[dict[str, str], bool]:
+  """
+    Compare results with a saved baseline.
+
+    Returns:
+        tuple: Status of each case and whether any output changed
+    """
+  status = {}
+  changed = False
+  if (baseline.get("n"), baseline.get("seed")) != (results["n"],
+                                                   results["seed"]):
+    print("warning: baseline was run with other --n / --seed, digests differ")
+  for name, result in results["cases"].items():
+    old = baseline["cases"].get(name)
+    if old is None:
+      status[name] = "new"
+      continue
+    ratio = result["ns_per_call"] / old["ns_per_call"]
+    text = f"x{ratio:.2f}"
+    if ratio > TIME_REGRESSION_RATIO:
+      text += " slower (advisory)"
+    if result["digest"] != old["digest"]:
+      text += " OUTPUT CHANGED"
+      changed = True
+    status[name] = text
+  return status, changed
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--n", type=int, default=20000, help="Frames per stream")
+  parser.add_argument("--repeat",
+                      type=int,
+                      default=DEFAULT_REPEAT,
+                      help="Timed runs per case, the best one is reported")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--only", nargs="+", help="Run only these cases")
+  parser.add_argument("--save", help="Write the results as a JSON baseline")
+  parser.add_argument("--compare", help="JSON baseline to compare with")
+  args = parser.parse_args()
+
+  cases = make_cases(build_inputs(args.n, args.seed))
+  if args.only:
+    unknown = set(args.only) - set(cases)
+    if unknown:
+      parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+    cases = {name: cases[name] for name in args.only}
+  results = {"n": args.n, "seed": args.seed, "cases": {}}
+  for name, (stream, factory) in cases.items():
+    results["cases"][name] = run_case(stream, factory, args.repeat)
+
+  status = {}
+  changed = False
+  if args.compare:
+    with open(args.compare) as f:
+      status, changed = compare(results, json.load(f))
+  print(f"{'case':>26} {'calls':>7} {'ns/call':>9} {'digest':>16}  baseline")
+  for name, result in results["cases"].items():
+    print(f"{name:>26} {result['calls']:>7} {result['ns_per_call']:>9.0f} "
+          f"{result['digest']:>16}  {status.get(name, '')}")
+  if args.save:
+    with open(args.save, "w") as f:
+      json.dump(results, f, indent=2)
+  if changed:
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  main()
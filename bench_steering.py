@@ -0,0 +1,134 @@
+"""
+Closed-loop line trace simulation comparing steering controllers.
+
+A differential-drive robot follows a winding line. The camera runs at
+CAMERA_FPS with one frame of latency and reports the line slope at a point
+CAMERA_LOOKAHEAD ahead of the robot, like the line trace camera; the control
+loop runs faster and calls the controller with the latest frame timestamp.
+Tracking error is the RMS lateral distance between robot and line.
+
+  python bench_steering.py --kp 300 --speeds 1700 1800 1850 1900
+"""
+
+import argparse
+import math
+import random
+from typing import Optional
+
+from steering import SteeringController
+
+CAMERA_FPS = 30
+CAMERA_JITTER = 0.004  # s
+CAMERA_LOOKAHEAD = 0.12  # m from the axle to the point the slope is seen at
+CAMERA_FOV = math.radians(60)  # Line outside this half angle is lost
+CONTROL_DT = 0.01  # s
+TRACK_WIDTH = 0.12  # m
+SPEED_PER_UNIT = 0.0015  # m/s per motor value away from 1500
+MOTOR_TAU = 0.05  # s, first order motor response
+LINE_AMPLITUDE = 0.2  # m
+LINE_WAVELENGTH = 0.8  # m
+SIM_DISTANCE = 6.0  # m
+
+
+def line_y(x: float) -> float:
+  return LINE_AMPLITUDE * math.sin(2 * math.pi * x / LINE_WAVELENGTH)
+
+
+def camera_slope(x: float, y: float, heading: float) -> Optional[float]:
+  """Slope of the line as seen by the camera, None if it is out of view."""
+  px = x + CAMERA_LOOKAHEAD * math.cos(heading)
+  py = y + CAMERA_LOOKAHEAD * math.sin(heading)
+  # Lateral offset of the line at the look-ahead point, left positive
+  lateral = (line_y(px) - py) * math.cos(heading)
+  angle = math.atan2(lateral, CAMERA_LOOKAHEAD)
+  if abs(angle) > CAMERA_FOV:
+    return None
+  theta = math.pi / 2 + angle
+  return math.tan(theta)
+
+
+def simulate(controller: SteeringController, seed: int = 0) -> dict:
+  """
+    Run the controller around the line once.
+
+    Args:
+        controller: Controller under test, reset before the run
+        seed: Seed of the camera timing jitter
+
+    Returns:
+        dict: rms_error (m), max_error (m), lost (frames without the line)
+            and time (s) to cover SIM_DISTANCE
+    """
+  rng = random.Random(seed)
+  controller.reset()
+  x, y = 0.0, line_y(0.0)
+  heading = math.atan(line_y(1e-3) / 1e-3)
+  v_left = v_right = 0.0
+  t = 0.0
+  next_frame = 0.0
+  frame: Optional[tuple[float, Optional[float]]] = None
+  delivered: Optional[tuple[float, Optional[float]]] = None
+  command = (1500, 1500)
+  squared = []
+  lost = 0
+  while x < SIM_DISTANCE and t < 60:
+    if t >= next_frame:
+      # The frame captured now is delivered at the next frame (latency)
+      if frame is not None:
+        delivered = frame
+        lost += delivered[1] is None
+      frame = (t, camera_slope(x, y, heading))
+      next_frame += 1 / CAMERA_FPS + rng.uniform(-CAMERA_JITTER, CAMERA_JITTER)
+    if delivered is not None:
+      command = controller.update(delivered[1], delivered[0])
+    target_left = (command[0] - 1500) * SPEED_PER_UNIT
+    target_right = (command[1] - 1500) * SPEED_PER_UNIT
+    v_left += (target_left - v_left) * CONTROL_DT / MOTOR_TAU
+    v_right += (target_right - v_right) * CONTROL_DT / MOTOR_TAU
+    v = (v_left + v_right) / 2
+    heading += (v_right - v_left) / TRACK_WIDTH * CONTROL_DT
+    x += v * math.cos(heading) * CONTROL_DT
+    y += v * math.sin(heading) * CONTROL_DT
+    t += CONTROL_DT
+    squared.append((y - line_y(x))**2)
+  return {
+      "rms_error": math.sqrt(sum(squared) / len(squared)),
+      "max_error": math.sqrt(max(squared)),
+      "lost": lost,
+      "time": t,
+  }
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--kp", type=float, default=300, help="COMPUTING_P")
+  parser.add_argument("--ki", type=float, default=0.0)
+  parser.add_argument("--kd", type=float, default=10.0)
+  parser.add_argument("--lookahead", type=float, default=0.05)
+  parser.add_argument("--speeds",
+                      type=int,
+                      nargs="+",
+                      default=[1700, 1800, 1850, 1900])
+  parser.add_argument("--seeds", type=int, default=5)
+  args = parser.parse_args()
+
+  controllers = {
+      "P": lambda speed: SteeringController(args.kp, default_speed=speed),
+      "PID+FF": lambda speed: SteeringController(args.kp, args.ki, args.kd,
+                                                 args.lookahead, speed),
+  }
+  print(f"{'speed':>6} {'controller':>10} {'rms[mm]':>8} {'max[mm]':>8} "
+        f"{'lost':>5} {'time[s]':>7}")
+  for speed in args.speeds:
+    for name, make in controllers.items():
+      runs = [simulate(make(speed), seed) for seed in range(args.seeds)]
+      rms = sum(run["rms_error"] for run in runs) / len(runs)
+      worst = max(run["max_error"] for run in runs)
+      lost = sum(run["lost"] for run in runs)
+      duration = sum(run["time"] for run in runs) / len(runs)
+      print(f"{speed:>6} {name:>10} {rms * 1000:>8.1f} {worst * 1000:>8.1f} "
+            f"{lost:>5} {duration:>7.2f}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,240 @@
+"""
+Asynchronous, bounded writer for debug camera frames.
+
+Frames are copied into a bounded queue and JPEG-encoded and written by worker
+threads, so the camera/control loop never waits for disk I/O. When the queue
+is full the oldest sampled frame is dropped; event frames are only dropped
+(oldest first) when the queue holds nothing else, and a sampled frame never
+replaces an event frame.
+
+main.py wraps the camera pre-callbacks with capture_writes(), which turns
+their cv2.imwrite("bin/<timestamp>_<name>.jpg", image) dumps into
+get_capture().submit(); code that owns the image can call submit() directly.
+The control loop calls get_capture().mark_event("green_mark") so that the
+next frames of every stream are written even when they are not sampled.
+"""
+
+import collections
+import functools
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+import cv2
+import numpy as np
+
+import modules.log
+
+logger = modules.log.get_logger()
+
+DEBUG_CAPTURE_DIR = "bin"
+DEBUG_CAPTURE_QUEUE_SIZE = 8
+DEBUG_CAPTURE_WORKERS = 2
+DEBUG_CAPTURE_EVERY_NTH = 10  # 0 writes only frames around events
+DEBUG_CAPTURE_EVENT_FRAMES = 3  # Frames written after each event
+DEBUG_CAPTURE_JPEG_QUALITY = 80
+
+
+class DebugCapture:
+  """Bounded drop-oldest queue of debug frames with a pool of writers."""
+
+  def __init__(self,
+               directory: str = DEBUG_CAPTURE_DIR,
+               queue_size: int = DEBUG_CAPTURE_QUEUE_SIZE,
+               workers: int = DEBUG_CAPTURE_WORKERS,
+               every_nth: int = DEBUG_CAPTURE_EVERY_NTH,
+               event_frames: int = DEBUG_CAPTURE_EVENT_FRAMES,
+               jpeg_quality: int = DEBUG_CAPTURE_JPEG_QUALITY):
+    self.directory = directory
+    self.every_nth = every_nth
+    self.event_frames = event_frames
+    self.jpeg_quality = jpeg_quality
+    self.queue_size = queue_size
+    self._queue: collections.deque = collections.deque()
+    self._cond = threading.Condition()
+    self._frame_cnt: dict[str, int] = collections.defaultdict(int)
+    self._event: Optional[str] = None
+    self._event_serial = 0
+    self._stream_serial: dict[str, int] = {}
+    self._event_left: dict[str, int] = collections.defaultdict(int)
+    self._closed = False
+    self.submitted = 0
+    self.skipped = 0
+    self.dropped = 0
+    self.dropped_events = 0
+    self.written = 0
+    self.failed = 0
+    os.makedirs(directory, exist_ok=True)
+    self._workers = [
+        threading.Thread(target=self._worker, daemon=True)
+        for _ in range(workers)
+    ]
+    for worker in self._workers:
+      worker.start()
+
+  def mark_event(self, event: str) -> None:
+    """Write the next event_frames frames of each stream, tagged by event."""
+    with self._cond:
+      self._event = event
+      self._event_serial += 1
+
+  def submit(self,
+             name: str,
+             image: np.ndarray,
+             timestamp: Optional[float] = None) -> bool:
+    """
+      Queue a frame if it is sampled or an event is pending.
+
+      Args:
+          name: Stream name used in the file name, e.g. "original"
+          image: BGR/gray image; it is copied, the caller may reuse it
+          timestamp: Capture time, defaults to now
+
+      Returns:
+          bool: True if the frame was queued
+      """
+    if timestamp is None:
+      timestamp = time.time()
+    with self._cond:
+      if self._closed:
+        return False
+      self._frame_cnt[name] += 1
+      # A stream seen for the first time does not pick up older events
+      serial = self._stream_serial.setdefault(name, self._event_serial)
+      if serial != self._event_serial:
+        self._stream_serial[name] = self._event_serial
+        self._event_left[name] = self.event_frames
+      event = None
+      if self._event_left[name] > 0:
+        event = self._event
+        self._event_left[name] -= 1
+      elif not self.every_nth or self._frame_cnt[name] % self.every_nth:
+        self.skipped += 1
+        return False
+      suffix = f"_{event}" if event else ""
+      path = os.path.join(self.directory, f"{timestamp:.3f}_{name}{suffix}.jpg")
+      if len(self._queue) >= self.queue_size:
+        victim = next(
+            (i for i, entry in enumerate(self._queue) if not entry[2]), None)
+        if victim is None and not event:
+          self.dropped += 1
+          return False
+        if victim is None:
+          victim = 0
+          self.dropped_events += 1
+        del self._queue[victim]
+        self.dropped += 1
+      self._queue.append((path, image.copy(), event is not None))
+      self.submitted += 1
+      self._cond.notify()
+    return True
+
+  def _worker(self) -> None:
+    params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+    while True:
+      with self._cond:
+        while not self._queue and not self._closed:
+          self._cond.wait()
+        if not self._queue:
+          return
+        path, image, _ = self._queue.popleft()
+      try:
+        ok = _imwrite(path, image, params)
+      except cv2.error as e:
+        logger.error(f"Failed to write debug image {path}: {e}")
+        ok = False
+      with self._cond:
+        if ok:
+          self.written += 1
+        else:
+          self.failed += 1
+
+  def stats(self) -> dict[str, int]:
+    """Counters of submitted, skipped, dropped, written and failed frames."""
+    with self._cond:
+      return {
+          "submitted": self.submitted,
+          "skipped": self.skipped,
+          "dropped": self.dropped,
+          "dropped_events": self.dropped_events,
+          "written": self.written,
+          "failed": self.failed,
+          "queued": len(self._queue),
+      }
+
+  def close(self, timeout: float = 2.0) -> None:
+    """Stop accepting frames and let the workers flush the queue."""
+    with self._cond:
+      self._closed = True
+      self._cond.notify_all()
+    deadline = time.time() + timeout
+    for worker in self._workers:
+      worker.join(max(0.0, deadline - time.time()))
+
+
+_capture: Optional[DebugCapture] = None
+_capture_lock = threading.Lock()
+_imwrite = cv2.imwrite
+_hook = threading.local()
+
+
+def get_capture() -> DebugCapture:
+  """Return the process-wide DebugCapture, starting it on first use."""
+  global _capture
+  with _capture_lock:
+    if _capture is None:
+      _capture = DebugCapture()
+    return _capture
+
+
+def close_capture() -> Optional[dict[str, int]]:
+  """Close the process-wide DebugCapture if it was started and return stats."""
+  with _capture_lock:
+    capture = _capture
+  if capture is None:
+    return None
+  capture.close()
+  return capture.stats()
+
+
+def _capturing_imwrite(path: str, image: np.ndarray, *args) -> bool:
+  """cv2.imwrite that queues the image while inside a capture_writes call."""
+  if not getattr(_hook, "active", False):
+    return _imwrite(path, image, *args)
+  stem = os.path.splitext(os.path.basename(path))[0]
+  timestamp_text, _, name = stem.partition("_")
+  try:
+    timestamp = float(timestamp_text)
+  except ValueError:
+    timestamp, name = None, stem
+  get_capture().submit(name or stem, image, timestamp)
+  return True
+
+
+def capture_writes(callback: Optional[Callable]) -> Optional[Callable]:
+  """
+    Wrap a camera callback so that its cv2.imwrite calls are queued.
+
+    cv2.imwrite is replaced once for the process; it only diverts writes made
+    by a wrapped callback on its own thread and writes directly otherwise.
+
+    Args:
+        callback: Camera pre-callback, or None
+
+    Returns:
+        Optional[Callable]: The wrapped callback (None if callback is None)
+    """
+  if callback is None:
+    return None
+  cv2.imwrite = _capturing_imwrite
+
+  @functools.wraps(callback)
+  def wrapper(*args, **kwargs):
+    _hook.active = True
+    try:
+      return callback(*args, **kwargs)
+    finally:
+      _hook.active = False
+
+  return wrapper
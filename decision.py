@@ -0,0 +1,387 @@
+"""
+Decision logic for line tracing and rescue.
+
+These functions only turn sensor/vision values into motor commands. They do
+not touch UART, cameras or module globals, so main.py and offline tools such
+as sweep.py run exactly the same code. main.py calls decide_linetrace and
+decide_rescue with a snapshot of each frame. The line trace state between
+frames lives in the SteeringController and GreenMarkFusion passed in, which
+decide_linetrace updates in place; everything else is side-effect free.
+"""
+
+import math
+from typing import (TYPE_CHECKING, Iterable, NamedTuple, Optional,
+                    Sequence)
+
+if TYPE_CHECKING:
+  from green_fusion import GreenMarkFusion
+  from steering import SteeringController
+
+MOTOR_MIN = 1000
+MOTOR_MAX = 2000
+MOTOR_NEUTRAL = 1500
+SPEED_CURVE_GAIN = 150
+BALL_CENTER_DEADBAND = 60
+MIN_DIST_TERM = 60
+CAGE_FORWARD_OFFSET = 150
+CAGE_RELEASE_RATIO = 3.8
+LINE_LOST_SLOWDOWN = 10  # Speed below default_speed while no line is seen
+
+SILVER_BALL_CLASS = 4
+
+TURN_LEFT = "left"
+TURN_RIGHT = "right"
+TURN_UTURN = "uturn"
+
+
+class Target(NamedTuple):
+  """Rescue target selected from YOLO boxes (offset is from image center)."""
+  position: float
+  size: float
+  y: float
+  w: float
+  h: float
+
+
+class BallCommand(NamedTuple):
+  left: int
+  right: int
+  back_off: bool
+  catch: bool
+
+
+class CageCommand(NamedTuple):
+  left: int
+  right: int
+  release: bool
+
+
+class LinetraceSnapshot(NamedTuple):
+  """Line trace camera values of one frame."""
+  timestamp: float
+  slope: Optional[float]
+  green_marks: Sequence[Sequence[float]] = ()
+  green_black_detected: Sequence[Sequence[int]] = ()
+
+
+class LinetraceCommand(NamedTuple):
+  left: int
+  right: int
+  turn: Optional[str]
+
+
+class RescueSnapshot(NamedTuple):
+  """Rescue camera detections of one frame and the search state."""
+  boxes: Sequence[tuple[int, float, float, float, float]]
+  image_width: float
+  image_height: float
+  valid_classes: Sequence[int]
+  is_ball_caching: bool
+
+
+class RescueCommand(NamedTuple):
+  """Motor values and actions for one rescue frame (target None: search)."""
+  left: int
+  right: int
+  target: Optional[Target]
+  valid_classes: list[int]
+  detected_classes: list[int]
+  silver_seen: bool
+  back_off: bool
+  catch: bool
+  release: bool
+
+
+def fix_to_range(x: int, min_num: int, max_num: int) -> int:
+  """
+    Clamp a value to a specified range.
+
+    Args:
+        x: Value to clamp
+        min_num: Minimum allowed value
+        max_num: Maximum allowed value
+
+    Returns:
+        int: Clamped value
+    """
+  return max(min_num, min(x, max_num))
+
+
+def line_angle(slope: float) -> float:
+  """
+    Convert a line slope to an angle in [0, pi).
+
+    Args:
+        slope: Line slope from the line trace camera
+
+    Returns:
+        float: Line angle, pi / 2 meaning straight ahead
+    """
+  theta = math.atan(slope)
+  if theta < 0:
+    theta += math.pi
+  return theta
+
+
+def compute_moving_value(current_theta: float, computing_p: float) -> float:
+  """
+    Compute motor movement value based on line slope.
+
+    Args:
+        current_theta: Current line slope
+        computing_p: Proportional steering gain
+
+    Returns:
+        float: Computed movement value
+    """
+  return computing_p * current_theta
+
+
+def compute_default_speed(slope: Optional[float],
+                          default_speed: int,
+                          gain: float = SPEED_CURVE_GAIN) -> int:
+  """
+    Compute default speed based on current slope.
+
+    Args:
+        slope: Line slope, or None when no line is visible
+        default_speed: Speed used when driving straight
+        gain: How strongly the speed drops with the line angle
+
+    Returns:
+        int: Forward speed for both motors
+    """
+  if slope is None:
+    return default_speed
+  current_theta = line_angle(slope)
+  # Use absolute angle directly - larger angles = more turning = slower speed
+  return int(default_speed - (abs(current_theta - math.pi / 2)**2) * gain)
+
+
+def find_best_target(
+    boxes: Iterable[tuple[int, float, float, float, float]],
+    image_width: float, valid_classes: list[int], is_ball_caching: bool
+) -> tuple[Optional[Target], list[int], list[int], bool]:
+  """
+    Pick the valid target closest to the image center.
+
+    While no ball is held, a silver ball always becomes the valid class as
+    soon as it is seen.
+
+    Args:
+        boxes: (cls, x_center, y_center, w, h) for each detection
+        image_width: Width of the rescue camera image
+        valid_classes: Classes currently searched for
+        is_ball_caching: Whether a ball is held
+
+    Returns:
+        tuple: Best target or None, detected classes, valid classes after
+            selection, and whether a silver ball switched the search
+    """
+  valid_classes = list(valid_classes)
+  detected_classes = []
+  silver_seen = False
+  best = None
+  min_dist = float("inf")
+  cx = image_width / 2.0
+  for cls, x_center, y_center, w, h in boxes:
+    detected_classes.append(cls)
+    if cls in valid_classes:
+      pass
+    elif not is_ball_caching and cls == SILVER_BALL_CLASS:
+      silver_seen = True
+      valid_classes = [SILVER_BALL_CLASS]
+    else:
+      continue
+    dist = x_center - cx
+    if abs(dist) < min_dist:
+      min_dist = abs(dist)
+      best = Target(dist, w * h, y_center, w, h)
+  return best, detected_classes, valid_classes, silver_seen
+
+
+def compute_ball_approach(target: Target, image_width: float,
+                          image_height: float, p: float, ap: float,
+                          ball_catch_size: float) -> BallCommand:
+  """
+    Compute motor values for driving towards a ball.
+
+    Args:
+        target: Ball selected by find_best_target
+        image_width: Width of the rescue camera image
+        image_height: Height of the rescue camera image
+        p: Steering gain on the horizontal offset
+        ap: Gain on the remaining distance (square root of area)
+        ball_catch_size: Box area at which the ball is close enough
+
+    Returns:
+        BallCommand: Motor values, whether to back off first and whether to
+            start catching
+    """
+  back_off = False
+  if abs(target.position) > BALL_CENTER_DEADBAND:
+    diff_angle = target.position * p
+  else:
+    diff_angle = 0
+  if ball_catch_size > target.size:
+    dist_term = (math.sqrt(ball_catch_size) - math.sqrt(target.size)) * ap
+    dist_term = int(max(MIN_DIST_TERM, dist_term))
+  else:
+    back_off = True
+    dist_term = 0
+    diff_angle = 0
+  base_L = MOTOR_NEUTRAL + diff_angle + dist_term
+  base_R = MOTOR_NEUTRAL - diff_angle + dist_term
+
+  # Ball is in the bottom quarter and its box covers the image center
+  is_bottom_third = target.y and target.y > (image_height * 3 / 4)
+  if target.w:
+    ball_left = target.position - target.w / 2 + image_width / 2
+    ball_right = target.position + target.w / 2 + image_width / 2
+    includes_center = ball_left <= image_width / 2 <= ball_right
+  else:
+    includes_center = False
+
+  if is_bottom_third and includes_center:
+    return BallCommand(MOTOR_NEUTRAL, MOTOR_NEUTRAL, back_off, True)
+  return BallCommand(int(fix_to_range(base_L, MOTOR_MIN, MOTOR_MAX)),
+                     int(fix_to_range(base_R, MOTOR_MIN, MOTOR_MAX)), back_off,
+                     False)
+
+
+def compute_cage_approach(target: Target, wp: float,
+                          ball_catch_size: float) -> CageCommand:
+  """
+    Compute motor values for driving towards a cage while holding a ball.
+
+    Args:
+        target: Cage selected by find_best_target
+        wp: Steering gain on the horizontal offset
+        ball_catch_size: Ball catch area, the release size is a multiple of it
+
+    Returns:
+        CageCommand: Motor values and whether to release the ball
+    """
+  if target.size >= ball_catch_size * CAGE_RELEASE_RATIO:
+    return CageCommand(MOTOR_NEUTRAL, MOTOR_NEUTRAL, True)
+  diff_angle = target.position * wp
+  base_L = MOTOR_NEUTRAL + diff_angle + CAGE_FORWARD_OFFSET
+  base_R = MOTOR_NEUTRAL - diff_angle + CAGE_FORWARD_OFFSET
+  return CageCommand(int(fix_to_range(base_L, MOTOR_MIN, MOTOR_MAX)),
+                     int(fix_to_range(base_R, MOTOR_MIN, MOTOR_MAX)), False)
+
+
+def green_mark_sides(detection: Sequence[int]) -> tuple[bool, bool]:
+  """
+    Read which side of the line a green mark is on.
+
+    Args:
+        detection: One entry of green_black_detected
+
+    Returns:
+        tuple[bool, bool]: Whether the mark asks for a left / right turn
+    """
+  if detection[0] == 1 or detection[1] == 0:
+    return False, False
+  return detection[2] == 1, detection[3] == 1
+
+
+def turn_from_sides(left: bool, right: bool) -> Optional[str]:
+  """Combine left/right green marks into TURN_* (None for no turn)."""
+  if left and right:
+    return TURN_UTURN
+  if left:
+    return TURN_LEFT
+  if right:
+    return TURN_RIGHT
+  return None
+
+
+def green_mark_turn(green_marks: Sequence[Sequence[float]],
+                    green_black_detected: Sequence[Sequence[int]],
+                    gate_y: float) -> Optional[str]:
+  """
+    Single-frame green mark decision.
+
+    Args:
+        green_marks: (x, y, ...) of each green mark
+        green_black_detected: Black line checks of each green mark
+        gate_y: A mark has to be below this image row to trigger a turn
+
+    Returns:
+        Optional[str]: TURN_* or None
+    """
+  left = right = False
+  for detection in green_black_detected:
+    is_left, is_right = green_mark_sides(detection)
+    left = left or is_left
+    right = right or is_right
+  if not any(mark[1] > gate_y for mark in green_marks):
+    return None
+  return turn_from_sides(left, right)
+
+
+def decide_linetrace(snapshot: LinetraceSnapshot,
+                     steering: "SteeringController",
+                     fusion: "GreenMarkFusion") -> LinetraceCommand:
+  """
+    Line trace decision for one control tick.
+
+    Updates steering and fusion in place, so pass the same objects every
+    tick and fresh (or reset) ones to start over. Ticks that see the same
+    frame again get the same motor values and no new turn. Both state
+    objects are reset when the line is lost, the steering also when a turn
+    is returned.
+
+    Args:
+        snapshot: Line trace camera values
+        steering: Steering state between frames, updated in place
+        fusion: Green mark state between frames, updated in place
+
+    Returns:
+        LinetraceCommand: Motor values and TURN_* or None
+    """
+  if snapshot.slope is None:
+    fusion.reset()
+    left, right = steering.update(None, snapshot.timestamp)
+    return LinetraceCommand(left, right, None)
+  left, right = steering.update(snapshot.slope, snapshot.timestamp)
+  turn = fusion.update(snapshot.timestamp, snapshot.green_marks,
+                       snapshot.green_black_detected)
+  if turn is not None:
+    steering.reset()
+  return LinetraceCommand(left, right, turn)
+
+
+def decide_rescue(snapshot: RescueSnapshot, p: float, ap: float, wp: float,
+                  ball_catch_size: float) -> RescueCommand:
+  """
+    Single-frame rescue decision: target selection and approach.
+
+    Args:
+        snapshot: Rescue camera detections and search state
+        p: Ball steering gain on the horizontal offset
+        ap: Ball gain on the remaining distance
+        wp: Cage steering gain on the horizontal offset
+        ball_catch_size: Box area at which a ball is close enough
+
+    Returns:
+        RescueCommand: Neutral motor values and no target when nothing valid
+            is visible, otherwise the ball or cage approach
+    """
+  target, detected_classes, valid_classes, silver_seen = find_best_target(
+      snapshot.boxes, snapshot.image_width, snapshot.valid_classes,
+      snapshot.is_ball_caching)
+  if target is None:
+    return RescueCommand(MOTOR_NEUTRAL, MOTOR_NEUTRAL, None, valid_classes,
+                         detected_classes, silver_seen, False, False, False)
+  if snapshot.is_ball_caching:
+    cage = compute_cage_approach(target, wp, ball_catch_size)
+    return RescueCommand(cage.left, cage.right, target, valid_classes,
+                         detected_classes, silver_seen, False, False,
+                         cage.release)
+  ball = compute_ball_approach(target, snapshot.image_width,
+                               snapshot.image_height, p, ap, ball_catch_size)
+  return RescueCommand(ball.left, ball.right, target, valid_classes,
+                       detected_classes, silver_seen, ball.back_off,
+                       ball.catch, False)
@@ -0,0 +1,226 @@
+"""
+Temporal fusion of green mark detections at intersections.
+
+Instead of reacting to a single snapshot of green_marks / green_black_detected,
+every green mark is tracked over the last GREEN_HISTORY camera frames and its
+left/right checks are voted on. The turn direction is latched as soon as a
+mark has GREEN_MIN_VOTES agreeing frames, while line tracing continues; the
+turn itself is returned once the tracked mark reaches GREEN_TURN_Y_RATIO of
+the image height (extrapolated with its image velocity after it leaves the
+frame). A confirmed mark that stops being detected after passing the old
+half-height gate still triggers its turn when the track expires. Frames more
+than GREEN_MAX_GAP apart (line lost, robot restarted) start over instead of
+extrapolating across the gap. This replaces the 0.5 s blind creep forward
+after the old gate.
+
+Replay a recorded trace against the single-frame decision:
+  python green_fusion.py trace.npz --height 120
+"""
+
+import argparse
+import collections
+import math
+from typing import Optional, Sequence
+
+import decision
+
+GREEN_HISTORY = 5
+GREEN_MIN_VOTES = 3
+GREEN_MATCH_DIST = 40  # Pixels in the lores image
+GREEN_TURN_Y_RATIO = 0.9
+GREEN_VELOCITY_ALPHA = 0.5
+GREEN_GATE_Y_RATIO = 0.5  # Single-frame gate of the old decision
+GREEN_MAX_GAP = 0.25  # s, a few frame periods
+
+
+class _Track:
+  """One green mark followed across frames."""
+
+  def __init__(self, x: float, y: float, timestamp: float, history: int):
+    self.x = x
+    self.y = y
+    self.vy = 0.0
+    self.timestamp = timestamp
+    self.missed = 0
+    self.votes = collections.deque(maxlen=history)
+
+  def predicted_y(self, timestamp: float) -> float:
+    return self.y + self.vy * (timestamp - self.timestamp)
+
+  def update(self, x: float, y: float, timestamp: float,
+             sides: tuple[bool, bool]) -> None:
+    dt = timestamp - self.timestamp
+    if dt > 0:
+      vy = (y - self.y) / dt
+      self.vy += GREEN_VELOCITY_ALPHA * (vy - self.vy)
+    self.x, self.y, self.timestamp = x, y, timestamp
+    self.missed = 0
+    self.votes.append(sides)
+
+  def sides(self, min_votes: int) -> tuple[bool, bool]:
+    left = sum(vote[0] for vote in self.votes) >= min_votes
+    right = sum(vote[1] for vote in self.votes) >= min_votes
+    return left, right
+
+
+class GreenMarkFusion:
+  """Ring buffer of green mark detections with per-mark tracking and voting."""
+
+  def __init__(self,
+               image_height: int,
+               history: int = GREEN_HISTORY,
+               min_votes: int = GREEN_MIN_VOTES,
+               match_dist: float = GREEN_MATCH_DIST,
+               turn_y_ratio: float = GREEN_TURN_Y_RATIO):
+    self.image_height = image_height
+    self.history = history
+    self.min_votes = min_votes
+    self.match_dist = match_dist
+    self.turn_y = image_height * turn_y_ratio
+    self.reset()
+
+  def reset(self) -> None:
+    """Forget all marks, e.g. after a turn was executed."""
+    self._tracks: list[_Track] = []
+    self._last_timestamp: Optional[float] = None
+    self.pending: Optional[str] = None
+
+  def _match(self, x: float, y: float, timestamp: float,
+             used: set[int]) -> Optional[_Track]:
+    best = None
+    best_dist = self.match_dist
+    for i, track in enumerate(self._tracks):
+      if i in used:
+        continue
+      dist = math.hypot(x - track.x, y - track.predicted_y(timestamp))
+      if dist <= best_dist:
+        best, best_dist = i, dist
+    if best is None:
+      return None
+    used.add(best)
+    return self._tracks[best]
+
+  def update(self, timestamp: float, green_marks: Sequence[Sequence[float]],
+             green_black_detected: Sequence[Sequence[int]]) -> Optional[str]:
+    """
+      Add one camera frame and decide whether to turn now.
+
+      Args:
+          timestamp: Capture time of the frame; repeated frames are ignored
+          green_marks: (x, y, ...) of each green mark
+          green_black_detected: Black line checks, parallel to green_marks
+
+      Returns:
+          Optional[str]: decision.TURN_* when the turn should start, else None
+      """
+    if timestamp == self._last_timestamp:
+      return None
+    if (self._last_timestamp is not None and
+        timestamp - self._last_timestamp > GREEN_MAX_GAP):
+      self.reset()
+    self._last_timestamp = timestamp
+
+    used: set[int] = set()
+    new_tracks = []
+    for mark, detection in zip(green_marks, green_black_detected):
+      x, y = float(mark[0]), float(mark[1])
+      sides = decision.green_mark_sides(detection)
+      track = self._match(x, y, timestamp, used)
+      if track is None:
+        track = _Track(x, y, timestamp, self.history)
+        track.votes.append(sides)
+        new_tracks.append(track)
+      else:
+        track.update(x, y, timestamp, sides)
+    for i, track in enumerate(self._tracks):
+      if i not in used:
+        track.missed += 1
+
+    # Confirmed tracks keep deciding the turn after they leave the frame
+    left = right = False
+    turn_now = False
+    kept = []
+    for track in self._tracks + new_tracks:
+      expired = (track.missed >= self.history or
+                 timestamp - track.timestamp > GREEN_MAX_GAP)
+      if not expired:
+        kept.append(track)
+      is_left, is_right = track.sides(self.min_votes)
+      if not (is_left or is_right):
+        continue
+      left = left or is_left
+      right = right or is_right
+      if expired:
+        # Confirmed and past the old gate: keep the turn the old code made
+        if track.y > self.image_height * GREEN_GATE_Y_RATIO:
+          turn_now = True
+        continue
+      reached = track.predicted_y(timestamp) >= self.turn_y
+      # Lost through the bottom of the image before the velocity was known
+      lost_low = track.missed and track.y > self.image_height * 3 / 4
+      if reached or lost_low:
+        turn_now = True
+    self._tracks = kept
+
+    self.pending = decision.turn_from_sides(left, right)
+    if turn_now and self.pending is not None:
+      turn = self.pending
+      self.reset()
+      return turn
+    return None
+
+
+def replay(trace: dict, image_height: int) -> list[tuple[float, str, str]]:
+  """
+    Run the fused and the single-frame decision over a recorded trace.
+
+    Args:
+        trace: Trace loaded with recording.load_trace
+        image_height: Height of the line trace lores image
+
+    Returns:
+        list: (time, "fused" or "single", turn) for every decision
+    """
+  marks_by_frame = collections.defaultdict(list)
+  for frame, row in zip(trace["mark_frame"], trace["marks"]):
+    marks_by_frame[int(frame)].append(row)
+  fusion = GreenMarkFusion(image_height)
+  decisions = []
+  previous_single = None
+  # Ticks repeating a camera frame share its frame_t and vote only once
+  for frame, t in enumerate(trace["frame_t"]):
+    if trace["is_rescue"][frame]:
+      continue
+    rows = marks_by_frame.get(frame, [])
+    green_marks = [row[:2] for row in rows]
+    green_black_detected = [[int(v) for v in row[2:]] for row in rows]
+    turn = fusion.update(float(t), green_marks, green_black_detected)
+    if turn:
+      decisions.append((float(t), "fused", turn))
+    # main.py used to act on the first frame passing the gate only
+    turn = decision.green_mark_turn(green_marks, green_black_detected,
+                                    image_height // 2)
+    if turn and turn != previous_single:
+      decisions.append((float(t), "single", turn))
+    previous_single = turn
+  return decisions
+
+
+def main() -> None:
+  from recording import load_trace
+
+  parser = argparse.ArgumentParser(description="Replay green mark decisions")
+  parser.add_argument("traces", nargs="+", help="Recorded trace npz files")
+  parser.add_argument("--height",
+                      type=int,
+                      required=True,
+                      help="LINETRACE_CAMERA_LORES_HEIGHT")
+  args = parser.parse_args()
+  for path in args.traces:
+    print(path)
+    for t, kind, turn in replay(load_trace(path), args.height):
+      print(f"  {t:.3f} {kind:6s} {turn}")
+
+
+if __name__ == "__main__":
+  main()
@@ -9,11 +9,17 @@ import modules.uart
 import modules.log
 import modules.camera
 import modules.settings
+import decision
+from recording import TraceRecorder
+from debug_capture import capture_writes, close_capture, get_capture
+from green_fusion import GreenMarkFusion
+from steering import SteeringController
+import rescue_map
+from rescue_map import RescueMap, camera_bearing
 from modules.uart import Message
 from enum import Enum
 import traceback
 import sys
-import math
 from typing import Optional
 import time
 import threading
@@ -31,13 +37,19 @@ BALL_CATCH_SIZE = 140000
 CAGE_RELEASE_SIZE = 1000000
 TURN_45_TIME = 0.5
 TURN_180_TIME = 2.4
-FORWARD_STEP_TIME = 0.3
+FORWARD_STEP_TIME = 1.5  # rescue_map.FORWARD_STEP (15 cm) at 1600
 WALL_DIST_THRESHOLD = 5.03072
 FRONT_CLEAR_THRESHOLD = 3.0
 MOTOR_MIN = 1000
 MOTOR_MAX = 2000
 MOTOR_NEUTRAL = 1500
 RESCUE_FLAG_TIME = 3.0
+# Line trace steering on top of modules.settings.COMPUTING_P (see steering.py)
+STEERING_KI = 0.0
+STEERING_KD = 0.0
+STEERING_LOOKAHEAD = 0.0
+# Record vision traces for sweep.py, e.g. "bin/trace.npz" (None to disable)
+RECORD_TRACE_PATH = None
 
 
 class ObjectClasses(Enum):
@@ -72,7 +84,6 @@ rescue_R_U_SONIC = None
 rescue_Moving_Flag = False
 rescue_reposition_cnt = 0
 rescue_last_yolo_time = time.time()
-previous_angle = 0
 
 # Initialize camera objects
 Rescue_Camera = modules.camera.Camera(
@@ -81,7 +92,8 @@ Rescue_Camera = modules.camera.Camera(
     size=modules.settings.RESCUE_CAMERA_SIZE,
     formats=modules.settings.RESCUE_CAMERA_FORMATS,
     lores_size=modules.settings.RESCUE_CAMERA_LORES_SIZE,
-    pre_callback_func=modules.settings.RESCUE_CAMERA_PRE_CALLBACK_FUNC)
+    pre_callback_func=capture_writes(
+        modules.settings.RESCUE_CAMERA_PRE_CALLBACK_FUNC))
 
 Linetrace_Camera = modules.camera.Camera(
     PORT=modules.settings.LINETRACE_CAMERA_PORT,
@@ -89,7 +101,8 @@ Linetrace_Camera = modules.camera.Camera(
     size=modules.settings.LINETRACE_CAMERA_SIZE,
     formats=modules.settings.LINETRACE_CAMERA_FORMATS,
     lores_size=modules.settings.LINETRACE_CAMERA_LORES_SIZE,
-    pre_callback_func=modules.settings.LINETRACE_CAMERA_PRE_CALLBACK_FUNC)
+    pre_callback_func=capture_writes(
+        modules.settings.LINETRACE_CAMERA_PRE_CALLBACK_FUNC))
 
 # Initialize UART communication
 uart_io = modules.uart.UART_CON()
@@ -101,6 +114,10 @@ Linetrace_Camera.start_cam()
 #Rescue_Camera.start_cam()
 
 message_id = 0
+trace_recorder = TraceRecorder(RECORD_TRACE_PATH) if RECORD_TRACE_PATH else None
+green_fusion = GreenMarkFusion(modules.settings.LINETRACE_CAMERA_LORES_HEIGHT)
+rescue_area_map = RescueMap()
+last_motor_command = (MOTOR_NEUTRAL, MOTOR_NEUTRAL, time.time())
 
 
 def send_speed(left_value: int, right_value: int) -> Message:
@@ -114,8 +131,14 @@ def send_speed(left_value: int, right_value: int) -> Message:
     Returns:
         Message: Message object if message sent successfully, None otherwise
     """
-  global message_id
+  global message_id, last_motor_command
   message_id += 1
+  # Dead-reckon the command that ran until now for the rescue area map
+  now = time.time()
+  if modules.settings.is_rescue_area:
+    previous_left, previous_right, previous_time = last_motor_command
+    rescue_area_map.move(previous_left, previous_right, now - previous_time)
+  last_motor_command = (left_value, right_value, now)
   try:
     uart_io.send_message(
         Message(message_id, f"MOTOR {int(left_value)} {int(right_value)}"))
@@ -221,51 +244,44 @@ def send_wire_command(wire_number: int) -> Message:
 
 logger.info("OBJECTS INITIALIZED")
 
-
-def fix_to_range(x: int, min_num: int, max_num: int) -> int:
-  """
-    Clamp a value to a specified range.
-    
-    Args:
-        x: Value to clamp
-        min_num: Minimum allowed value
-        max_num: Maximum allowed value
-        
-    Returns:
-        int: Clamped value
-    """
-  return max(min_num, min(x, max_num))
+default_speed = 1700
+is_object = False
+object_second_phase = False
+steering_controller = SteeringController(modules.settings.COMPUTING_P,
+                                         STEERING_KI, STEERING_KD,
+                                         STEERING_LOOKAHEAD, default_speed)
 
 
-def compute_moving_value(current_theta: float) -> float:
-  """
-    Compute motor movement value based on line slope.
-    
-    Args:
-        current_theta: Current line slope
-        
-    Returns:
-        float: Computed movement value
-    """
-  return modules.settings.COMPUTING_P * current_theta
+def yolo_boxes_to_tuples(boxes) -> list[tuple[int, float, float, float, float]]:
+  """Convert YOLO boxes to (cls, x_center, y_center, w, h) tuples."""
+  ret = []
+  for box in boxes:
+    try:
+      cls = int(box.cls[0])
+    except Exception:
+      continue
+    ret.append((cls, *map(float, box.xywh[0])))
+  return ret
 
 
-default_speed = 1700
-is_object = False
-object_second_phase = False
+def drive_for(left_value: int, right_value: int, duration: float) -> None:
+  """Send motor values for duration seconds, then stop."""
+  prev_time_rotarymars = time.time()
+  while time.time() - prev_time_rotarymars < duration:
+    send_speed(left_value, right_value)
+  send_speed(1500, 1500)
 
 
-def compute_default_speed() -> int:
-  """Compute default speed based on current slope."""
-  global default_speed
-  if modules.settings.slope is None:
-    return default_speed
+def rescue_search_step() -> float:
+  """
+    Turn / step forward as planned on the rescue area map.
 
-  current_theta = math.atan(modules.settings.slope)
-  if current_theta < 0:
-    current_theta += math.pi
-  # Use absolute angle directly - larger angles = more turning = slower speed
-  return int(default_speed - (abs(current_theta - math.pi / 2)**2) * 150)
+    Returns:
+        float: Degrees turned (positive left)
+  """
+  return rescue_map.search_step(rescue_area_map, drive_for,
+                                get_ultrasonic_distance, TURN_45_TIME,
+                                TURN_180_TIME, FORWARD_STEP_TIME)
 
 
 # TODO: Removing some day
@@ -282,11 +298,10 @@ def main_loop():
   global rescue_target_y, rescue_target_w, rescue_target_h
   global rescue_cnt_turning_degrees, rescue_cnt_turning_side
   global rescue_L_Motor_Value, rescue_R_Motor_Value, rescue_Arm_Move_Flag
-  #global rescue_L_U_SONIC, rescue_F_U_SONIC, rescue_R_U_SONIC
+  global rescue_L_U_SONIC, rescue_F_U_SONIC, rescue_R_U_SONIC
   global rescue_Moving_Flag
   global none_slop_time,is_slop_none,rescue_reposition_cnt
   global ultrasonic_increment, distances, rescue_last_yolo_time, rescue_current_ball_type
-  global previous_angle
   message_id += 1
 
   try:
@@ -307,6 +322,7 @@ def main_loop():
         Linetrace_Camera.stop_cam()
         time.sleep(1)
         Is_Rescue_Camera_Start = True
+        rescue_area_map.reset()
 
       # Check stop button before rescue logic
       uart_io.send_message(Message(message_id, "GET button"))
@@ -315,15 +331,15 @@ def main_loop():
         send_speed(1500, 1500)
         return
 
+      if ultrasonic_increment % 2 == 0 and len(distances) >= 3:
+        rescue_L_U_SONIC, rescue_F_U_SONIC, rescue_R_U_SONIC = distances[:3]
+        rescue_area_map.add_ultrasonic(distances[:3])
+
       # EXPANDED RESCUE_LOOP_FUNC LOGIC
       if modules.settings.yolo_results is None:
         logger.debug("No YOLO results available, stopping motors.")
         # EXPANDED CHANGE_POSITION LOGIC
-        previous_time_rotarymars = time.time()
-        while time.time() - previous_time_rotarymars < TURN_45_TIME:
-          send_speed(1750, 1250)
-        send_speed(1500, 1500)
-        rescue_cnt_turning_degrees += 35
+        rescue_cnt_turning_degrees += abs(rescue_search_step())
         logger.debug(f"cnt degrees{rescue_cnt_turning_degrees}")
         logger.debug(f"L: {rescue_L_Motor_Value} R: {rescue_R_Motor_Value}")
       else:
@@ -350,59 +366,37 @@ def main_loop():
         results = modules.settings.yolo_results
         image_height = results[0].orig_shape[0]
         image_width = results[0].orig_shape[1]
+        if trace_recorder:
+          trace_recorder.add_rescue(time.time(),
+                                    yolo_boxes_to_tuples(results[0].boxes),
+                                    image_width, image_height,
+                                    rescue_valid_classes)
         # EXPANDED FIND_BEST_TARGET LOGIC
-        boxes = results[0].boxes
-        detected_classes = []
-        if not boxes:
-          rescue_target_position = None
-          rescue_target_size = None
+        boxes = yolo_boxes_to_tuples(results[0].boxes)
+        rescue_area_map.add_camera_view([
+            camera_bearing(box[1], image_width)
+            for box in boxes
+            if box[0] in (ObjectClasses.BLACK_BALL.value,
+                          ObjectClasses.SILVER_BALL.value)
+        ])
+        command = decision.decide_rescue(
+            decision.RescueSnapshot(boxes, image_width, image_height,
+                                    rescue_valid_classes,
+                                    rescue_is_ball_caching), P, AP, WP,
+            BALL_CATCH_SIZE)
+        rescue_valid_classes = command.valid_classes
+        if command.silver_seen:
+          rescue_cnt_turning_degrees = 0
+        if command.target is not None:
+          (rescue_target_position, rescue_target_size, rescue_target_y,
+           rescue_target_w, rescue_target_h) = command.target
         else:
-          best_target_pos = None
-          best_target_area = None
-          best_target_y = None
-          best_target_w = None
-          best_target_h = None
-          min_dist = float("inf")
-          cx = image_width / 2.0
-          for box in boxes:
-            try:
-              cls = int(box.cls[0])
-              detected_classes.append(cls)
-            except Exception:
-              continue
-            if cls in rescue_valid_classes:
-              x_center, y_center, w, h = map(float, box.xywh[0])
-              dist = x_center - cx
-              area = w * h
-              if abs(dist) < min_dist:
-                min_dist = abs(dist)
-                best_target_pos = dist
-                best_target_area = area
-                best_target_y = y_center
-                best_target_w = w
-                best_target_h = h
-              logger.debug(
-                  f"Detected cls={cls}, area={area:.1f}, offset={dist:.1f}")
-            elif not rescue_is_ball_caching and cls == ObjectClasses.SILVER_BALL.value:
-              rescue_cnt_turning_degrees = 0
-              rescue_valid_classes = [ObjectClasses.SILVER_BALL.value]
-              x_center, y_center, w, h = map(float, box.xywh[0])
-              dist = x_center - cx
-              area = w * h
-              if abs(dist) < min_dist:
-                min_dist = abs(dist)
-                best_target_pos = dist
-                best_target_area = area
-                best_target_y = y_center
-                best_target_w = w
-                best_target_h = h
-              logger.debug(
-                  f"Detected cls={cls}, area={area:.1f}, offset={dist:.1f}")
-          rescue_target_position = best_target_pos
-          rescue_target_size = best_target_area
-          rescue_target_y = best_target_y
-          rescue_target_w = best_target_w
-          rescue_target_h = best_target_h
+          rescue_target_position = rescue_target_size = None
+          rescue_target_y = rescue_target_w = rescue_target_h = None
+        if boxes:
+          detected_classes = command.detected_classes
+          best_target_pos = rescue_target_position
+          best_target_area = rescue_target_size
           if rescue_valid_classes == ObjectClasses.BLACK_BALL:
             logger.debug("Valid Class:Black Ball")
           if rescue_valid_classes == ObjectClasses.SILVER_BALL:
@@ -439,11 +433,7 @@ def main_loop():
         elif rescue_target_position is None or rescue_target_size is None:
           logger.debug("No target found -> executing change_position()")
           # EXPANDED CHANGE_POSITION LOGIC
-          prev_time_rotarymars = time.time()
-          while time.time() - prev_time_rotarymars < TURN_45_TIME:
-            send_speed(1750, 1250)
-          send_speed(1500, 1500)
-          rescue_cnt_turning_degrees += 45
+          rescue_cnt_turning_degrees += abs(rescue_search_step())
         else:
           rescue_cnt_turning_degrees = 0 if rescue_valid_classes == [ObjectClasses.SILVER_BALL.value] else 360
           if True:
@@ -453,21 +443,11 @@ def main_loop():
             # EXPANDED SET_MOTOR_SPEEDS LOGIC
 
             if not rescue_is_ball_caching:
-              if abs(rescue_target_position) > 60:
-                diff_angle = rescue_target_position * P
-              else:
-                diff_angle = 0
-              if BALL_CATCH_SIZE > rescue_target_size:
-                dist_term = (math.sqrt(BALL_CATCH_SIZE) -
-                             math.sqrt(rescue_target_size)) * AP
-                dist_term = int(max(60,dist_term))
-              else:
+              if command.back_off:
                 prev_time_rotarymars = time.time()
                 while time.time() - prev_time_rotarymars < 3:
                   send_speed(1450,1450)
                 send_speed(1500,1500)
-                dist_term = 0
-                diff_angle = 0
               # reposition counter logic
               #if BALL_CATCH_SIZE < rescue_target_size and abs(rescue_target_position) > 90:
               #    rescue_reposition_cnt += 1
@@ -488,30 +468,15 @@ def main_loop():
               #        rescue_reposition_cnt = 0
               #rescue_reposition_cnt = 0
 
-
-              base_L = 1500 + diff_angle + dist_term
-              base_R = 1500 - diff_angle + dist_term
-
-              # Check if ball is in bottom 1/3 and centered horizontally
-              # Ball Y is in bottom 1/3 of image
-              is_bottom_third = rescue_target_y and rescue_target_y > (image_height * 3 / 4)
-              # Ball's left and right edges include the center X coordinate
-              if rescue_target_w:
-                ball_left = rescue_target_position - rescue_target_w / 2 + image_width / 2
-                ball_right = rescue_target_position + rescue_target_w / 2 + image_width / 2
-                includes_center = ball_left <= image_width / 2 <= ball_right
-              else:
-                includes_center = False
-
-              if is_bottom_third and includes_center:
-                logger.debug(
-                    f"Robot close to ball (base_L={base_L:.1f}, base_R={base_R:.1f}). Initiating catch_ball()"
-                )
+              # Catch once the ball is in the bottom of the image and centered
+              if command.catch:
+                logger.debug("Robot close to ball. Initiating catch_ball()")
                 logger.debug("Executing catch_ball()")
                 logger.debug("---Ball catch")
                 # Store which ball type we're catching
                 rescue_current_ball_type = rescue_valid_classes[0]
                 logger.debug(f"Caught ball type: {rescue_current_ball_type}")
+                get_capture().mark_event("rescue_catch")
                 send_speed(1500, 1500)
                 send_arm(1400, 0)
                 time.sleep(1)
@@ -531,21 +496,18 @@ def main_loop():
                 while time.time() - prev_time_rotarymars < 1:
                   send_speed(1450, 1450)
                 send_speed(1500, 1500)
+                rescue_area_map.ball_caught()
                 rescue_is_ball_caching = True
                 rescue_L_Motor_Value = MOTOR_NEUTRAL
                 rescue_R_Motor_Value = MOTOR_NEUTRAL
               else: # TODO: ADD EXIT
-                rescue_L_Motor_Value = int(min(max(base_L, 1000), 2000))
-                rescue_R_Motor_Value = int(min(max(base_R, 1000), 2000))
+                rescue_L_Motor_Value = command.left
+                rescue_R_Motor_Value = command.right
                 send_speed(rescue_L_Motor_Value, rescue_R_Motor_Value)
 
             else:
-              diff_angle = rescue_target_position * WP
-              base_L = 1500 + diff_angle + 150
-              base_R = 1500 - diff_angle + 150
-
               # Check if cage is large enough to release ball (3.8x ball catch size)
-              if rescue_target_size >= BALL_CATCH_SIZE * 3.8:
+              if command.release:
                 logger.debug(
                     f"Cage large enough (size={rescue_target_size:.1f}, threshold={BALL_CATCH_SIZE * 4}). Initiating release_ball()"
                 )
@@ -583,8 +545,8 @@ def main_loop():
                 rescue_current_ball_type = None
                 rescue_cnt_turning_degrees = 0  # Reset to search for silver balls again
               else:
-                rescue_L_Motor_Value = int(min(max(base_L, 1000), 2000))
-                rescue_R_Motor_Value = int(min(max(base_R, 1000), 2000))
+                rescue_L_Motor_Value = command.left
+                rescue_R_Motor_Value = command.right
                 send_speed(rescue_L_Motor_Value, rescue_R_Motor_Value)
         logger.debug(
             f"Motor Values after run: L={rescue_L_Motor_Value}, R={rescue_R_Motor_Value}"
@@ -631,6 +593,17 @@ def main_loop():
       if distances[1] < 8:
         is_object = True
         return
+      if trace_recorder:
+        trace_recorder.add_linetrace(
+            time.time(), modules.settings.slope, modules.settings.green_marks,
+            modules.settings.green_black_detected,
+            modules.settings.last_linetrace_precallback_time)
+      command = decision.decide_linetrace(
+          decision.LinetraceSnapshot(
+              modules.settings.last_linetrace_precallback_time,
+              modules.settings.slope, modules.settings.green_marks,
+              modules.settings.green_black_detected), steering_controller,
+          green_fusion)
       if modules.settings.slope is None:
         if not is_slop_none:
           if time.time() - none_slop_time > RESCUE_FLAG_TIME:
@@ -640,7 +613,7 @@ def main_loop():
         else:
           none_slop_time = time.time()
           is_slop_none = True
-        send_speed(compute_default_speed() - 10, compute_default_speed() - 10)
+        send_speed(command.left, command.right)
         return
       else:
         is_slop_none = False
@@ -649,63 +622,24 @@ def main_loop():
         send_speed(1500, 1500)
         logger.debug("Linetrace precallback not called, stopping...")
 
-      current_theta = math.atan(modules.settings.slope)
-      if current_theta < 0:
-        current_theta += math.pi
-
-      if current_theta > math.pi / 2:  # ← / に修正
-        current_theta -= math.pi / 2
-        send_speed(
-            fix_to_range(
-                compute_default_speed() - compute_moving_value(current_theta),
-                1000, 2000),
-            fix_to_range(
-                compute_default_speed() + compute_moving_value(current_theta),
-                1000, 2000))
-      elif current_theta < math.pi / 2:
-        current_theta = math.pi / 2 - current_theta
-        send_speed(
-            fix_to_range(
-                compute_default_speed() + compute_moving_value(current_theta),
-                1000, 2000),
-            fix_to_range(
-                compute_default_speed() - compute_moving_value(current_theta),
-                1000, 2000))
-      else:
-        send_speed(compute_default_speed() - 10, compute_default_speed() - 10)
-
-      if modules.settings.green_black_detected:
-        all_checks = [False, False]  # [left, right]
-        should_detect = False
-        for i in modules.settings.green_black_detected:
-          if i[0] == 1:
-            continue
-          if i[1] == 0:
-            continue
-          if i[2] == 1:
-            all_checks[0] = True
-          if i[3] == 1:
-            all_checks[1] = True
-        for i in modules.settings.green_marks:
-          if i[1] > modules.settings.LINETRACE_CAMERA_LORES_HEIGHT // 2:
-            should_detect = True
-            break
-        if (all_checks[0] or all_checks[1]) and should_detect:
+      send_speed(command.left, command.right)
+
+      turn = command.turn
+      if turn is not None:
+        logger.debug(f"Green mark turn: {turn}")
+        get_capture().mark_event("green_mark")
+        if turn == decision.TURN_UTURN:
+          prev_time_rotarymars = time.time()
+          while time.time() - prev_time_rotarymars < 3.5:
+            send_speed(1750, 1250)
+        elif turn == decision.TURN_LEFT:
+          prev_time_rotarymars = time.time()
+          while time.time() - prev_time_rotarymars < 1.5:
+            send_speed(1750, 1250)
+        elif turn == decision.TURN_RIGHT:
           prev_time_rotarymars = time.time()
-          while time.time() - prev_time_rotarymars < 0.5:
-            send_speed(compute_default_speed(), compute_default_speed())
-          if all_checks[0] and all_checks[1]:
-            prev_time_rotarymars = time.time()
-            while time.time() - prev_time_rotarymars < 3.5:
-              send_speed(1750, 1250)
-          elif all_checks[0]:
-            prev_time_rotarymars = time.time()
-            while time.time() - prev_time_rotarymars < 1.5:
-              send_speed(1750, 1250)
-          elif all_checks[1]:
-            prev_time_rotarymars = time.time()
-            while time.time() - prev_time_rotarymars < 1.5:
-              send_speed(1200, 1750)
+          while time.time() - prev_time_rotarymars < 1.5:
+            send_speed(1200, 1750)
 
   except KeyboardInterrupt:
     logger.info("STOPPING PROCESS BY KeyboardInterrupt")
@@ -749,6 +683,9 @@ if __name__ == "__main__":
         rescue_R_Motor_Value = MOTOR_NEUTRAL
         rescue_Arm_Move_Flag = 0
         rescue_last_yolo_time = time.time()
+        rescue_area_map.reset()
+        green_fusion.reset()
+        steering_controller.reset()
 
   except KeyboardInterrupt:
     logger.info("PROCESS INTERRUPTED BY USER")
@@ -759,7 +696,12 @@ if __name__ == "__main__":
   finally:
     # Cleanup
     try:
+      if trace_recorder:
+        trace_recorder.save()
       uart_io.close()
+      capture_stats = close_capture()
+      if capture_stats is not None:
+        logger.info(f"Debug capture: {capture_stats}")
       Linetrace_Camera.stop_cam()
       Rescue_Camera.stop_cam()
       logger.info("PROCESS ENDED")
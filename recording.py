@@ -0,0 +1,114 @@
+"""
+Recording of line trace / rescue vision traces for offline replay.
+
+A trace is an uncompressed npz file with one row per control tick:
+  t:            tick timestamp (time.time())
+  frame_t:      capture time of the camera frame the tick used; ticks that
+                see the same frame again repeat it (t for rescue ticks)
+  slope:        line slope, NaN when no line (or a rescue tick)
+  is_rescue:    1 for rescue ticks, 0 for line trace ticks
+  image_size:   (width, height) of the rescue image, 0 for line trace ticks
+  valid_class:  class searched for on a rescue tick, -1 if not recorded
+  box_frame:    index of the tick each YOLO box belongs to
+  boxes:        (cls, x_center, y_center, w, h) for each YOLO box
+  mark_frame:   index of the tick each green mark belongs to
+  marks:        (x, y, *green_black_detected entry) for each green mark
+"""
+
+import threading
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+
+class TraceRecorder:
+  """Collects per-tick vision values in memory and writes them as npz."""
+
+  def __init__(self, path: str):
+    self.path = path
+    self._lock = threading.Lock()
+    self._t: list[float] = []
+    self._frame_t: list[float] = []
+    self._slope: list[float] = []
+    self._is_rescue: list[int] = []
+    self._image_size: list[tuple[int, int]] = []
+    self._valid_class: list[int] = []
+    self._box_frame: list[int] = []
+    self._boxes: list[tuple[int, float, float, float, float]] = []
+    self._mark_frame: list[int] = []
+    self._marks: list[tuple[float, ...]] = []
+
+  def add_linetrace(self,
+                    timestamp: float,
+                    slope: Optional[float],
+                    green_marks: Sequence[Sequence[float]] = (),
+                    green_black_detected: Sequence[Sequence[int]] = (),
+                    frame_timestamp: Optional[float] = None) -> None:
+    """
+      Record a line trace tick and its green marks.
+
+      Args:
+          timestamp: Tick time
+          slope: Line slope, None when no line is visible
+          green_marks: (x, y, ...) of each green mark
+          green_black_detected: Black line checks, parallel to green_marks
+          frame_timestamp: Capture time of the frame the values come from,
+              defaults to timestamp
+      """
+    with self._lock:
+      frame = len(self._t)
+      for mark, detection in zip(green_marks, green_black_detected):
+        self._mark_frame.append(frame)
+        self._marks.append((mark[0], mark[1], *detection[:4]))
+      self._t.append(timestamp)
+      self._frame_t.append(timestamp if frame_timestamp is None else
+                           frame_timestamp)
+      self._slope.append(np.nan if slope is None else slope)
+      self._is_rescue.append(0)
+      self._image_size.append((0, 0))
+      self._valid_class.append(-1)
+
+  def add_rescue(self,
+                 timestamp: float,
+                 boxes: Iterable[tuple[int, float, float, float, float]],
+                 image_width: int,
+                 image_height: int,
+                 valid_classes: Sequence[int] = ()) -> None:
+    """Record a rescue tick with its (cls, x, y, w, h) boxes."""
+    with self._lock:
+      frame = len(self._t)
+      self._t.append(timestamp)
+      self._frame_t.append(timestamp)
+      self._slope.append(np.nan)
+      self._is_rescue.append(1)
+      self._image_size.append((image_width, image_height))
+      self._valid_class.append(valid_classes[0] if valid_classes else -1)
+      for box in boxes:
+        self._box_frame.append(frame)
+        self._boxes.append(box)
+
+  def save(self) -> None:
+    """Write everything recorded so far to self.path."""
+    with self._lock:
+      np.savez(self.path,
+               t=np.asarray(self._t, dtype=np.float64),
+               frame_t=np.asarray(self._frame_t, dtype=np.float64),
+               slope=np.asarray(self._slope, dtype=np.float64),
+               is_rescue=np.asarray(self._is_rescue, dtype=np.int8),
+               image_size=np.asarray(self._image_size,
+                                     dtype=np.int32).reshape(-1, 2),
+               valid_class=np.asarray(self._valid_class, dtype=np.int8),
+               box_frame=np.asarray(self._box_frame, dtype=np.int64),
+               boxes=np.asarray(self._boxes, dtype=np.float64).reshape(-1, 5),
+               mark_frame=np.asarray(self._mark_frame, dtype=np.int64),
+               marks=np.asarray(self._marks, dtype=np.float64).reshape(-1, 6))
+
+
+def load_trace(path: str) -> dict[str, np.ndarray]:
+  """Load a trace written by TraceRecorder."""
+  with np.load(path) as data:
+    trace = {key: data[key] for key in data.files}
+  # Traces recorded before frame_t existed only have the tick time
+  trace.setdefault("frame_t", trace["t"])
+  trace.setdefault("valid_class", np.full(len(trace["t"]), -1, dtype=np.int8))
+  return trace
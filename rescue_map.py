@@ -0,0 +1,256 @@
+"""
+Occupancy map of the rescue area for searching balls.
+
+The robot pose is dead-reckoned from the motor commands sent while in the
+rescue area, the L/F/R ultrasonic readings mark free and occupied cells, and
+every YOLO frame marks the camera cone as seen and adds ball evidence along
+the bearing of each detected ball. RescueMap.plan() then picks the heading
+with the most unseen free cells and ball evidence instead of rotating blindly,
+and search_step() carries the chosen move out with the caller's motors.
+
+All lengths are in cm, angles in rad with heading 0 along +x and positive
+counter-clockwise. The map starts with the robot in the middle facing +y.
+"""
+
+import math
+from typing import Callable, Sequence
+
+import numpy as np
+
+RESCUE_MAP_SIZE = 300  # cm, larger than the area as the entry is unknown
+RESCUE_MAP_CELL = 5  # cm
+ULTRASONIC_ANGLES = (math.pi / 2, 0.0, -math.pi / 2)  # L, F, R sensors
+ULTRASONIC_MAX_RANGE = 150  # cm, longer readings are "no echo"
+ULTRASONIC_TIMEOUT = 1000  # Reading of get_ultrasonic_distance() on timeout
+CAMERA_HALF_FOV = math.radians(30)
+CAMERA_RANGE = 80  # cm within which balls are reliably detected
+LOG_ODDS_HIT = 0.9
+LOG_ODDS_MISS = -0.4
+LOG_ODDS_LIMIT = 4.0
+OCCUPIED_LOG_ODDS = 0.5
+BALL_HIT = 1.0
+BALL_DECAY = 0.2  # Evidence kept in a seen cell without a detection
+BALL_WEIGHT = 20.0  # One unit of ball evidence is worth this many cells
+TURN_COST = 0.6  # Score lost per degree turned
+FORWARD_STEP = 15  # cm driven by one forward search step
+FORWARD_CLEAR = 25  # cm that have to be free in front to step forward
+FORWARD_STEP_SPEED = 1600
+SEARCH_TURN_SPEEDS = (1250, 1750)  # Slow / fast side of a search turn
+
+# Motion model from the motor values (see TURN_45_TIME in main.py)
+SPEED_PER_UNIT = 0.1  # cm/s per motor value away from 1500
+TURN_RATE_PER_UNIT = (math.pi / 4) / 0.5 / 500  # rad/s per L-R difference
+
+
+def wrap_angle(angle):
+  """Wrap an angle (or array of angles) to [-pi, pi)."""
+  return (angle + math.pi) % (2 * math.pi) - math.pi
+
+
+def turn_time(degrees: float, turn_45_time: float,
+              turn_180_time: float) -> float:
+  """Time to rotate in place, interpolating the 45 and 180 degree times."""
+  degrees = abs(degrees)
+  if degrees <= 45:
+    return degrees / 45 * turn_45_time
+  return turn_45_time + (degrees - 45) / 135 * (turn_180_time - turn_45_time)
+
+
+def camera_bearing(x_center: float, image_width: float) -> float:
+  """Bearing of an image column from the heading, positive to the left."""
+  return -(x_center - image_width / 2) / image_width * 2 * CAMERA_HALF_FOV
+
+
+class RescueMap:
+  """Log-odds occupancy grid plus seen and ball evidence layers."""
+
+  def __init__(self,
+               size: float = RESCUE_MAP_SIZE,
+               cell: float = RESCUE_MAP_CELL):
+    self.cell = cell
+    self.cells = int(size // cell)
+    centers = (np.arange(self.cells) + 0.5) * cell - size / 2
+    self._cx, self._cy = np.meshgrid(centers, centers, indexing="ij")
+    self.reset()
+
+  def reset(self) -> None:
+    """Clear the map and put the robot back in the middle facing +y."""
+    shape = (self.cells, self.cells)
+    self.log_odds = np.zeros(shape, dtype=np.float32)
+    self.seen = np.zeros(shape, dtype=bool)
+    self.ball = np.zeros(shape, dtype=np.float32)
+    self.x = 0.0
+    self.y = 0.0
+    self.heading = math.pi / 2
+
+  def _index(self, x: np.ndarray, y: np.ndarray) -> tuple:
+    ix = np.floor(x / self.cell + self.cells / 2).astype(int)
+    iy = np.floor(y / self.cell + self.cells / 2).astype(int)
+    inside = (ix >= 0) & (ix < self.cells) & (iy >= 0) & (iy < self.cells)
+    return ix[inside], iy[inside]
+
+  def move(self, left: float, right: float, dt: float) -> None:
+    """Dead-reckon dt seconds of the given motor values."""
+    v = ((left + right) / 2 - 1500) * SPEED_PER_UNIT
+    omega = (right - left) * TURN_RATE_PER_UNIT
+    mid_heading = self.heading + omega * dt / 2
+    self.x += v * math.cos(mid_heading) * dt
+    self.y += v * math.sin(mid_heading) * dt
+    self.heading = wrap_angle(self.heading + omega * dt)
+
+  def _ray(self, angle: float, length: float) -> tuple:
+    steps = np.arange(0.0, length, self.cell / 2)
+    return self._index(self.x + steps * math.cos(angle),
+                       self.y + steps * math.sin(angle))
+
+  def add_ultrasonic(self, distances: Sequence[float]) -> None:
+    """
+      Mark cells along the L/F/R ultrasonic rays as free / occupied.
+
+      Timeout readings (ULTRASONIC_TIMEOUT and above) carry no information
+      and are skipped, other readings beyond ULTRASONIC_MAX_RANGE are
+      "no echo" and only mark the ray as free.
+      """
+    for offset, distance in zip(ULTRASONIC_ANGLES, distances):
+      if distance >= ULTRASONIC_TIMEOUT:
+        continue
+      angle = self.heading + offset
+      hit = distance < ULTRASONIC_MAX_RANGE
+      free = self._ray(angle, min(distance, ULTRASONIC_MAX_RANGE))
+      self.log_odds[free] += LOG_ODDS_MISS
+      if hit:
+        end = self._index(np.array([self.x + distance * math.cos(angle)]),
+                          np.array([self.y + distance * math.sin(angle)]))
+        self.log_odds[end] += LOG_ODDS_HIT - LOG_ODDS_MISS
+    np.clip(self.log_odds, -LOG_ODDS_LIMIT, LOG_ODDS_LIMIT, out=self.log_odds)
+
+  def _cone(self, heading: float, half_fov: float, length: float) -> np.ndarray:
+    dx = self._cx - self.x
+    dy = self._cy - self.y
+    diff = wrap_angle(np.arctan2(dy, dx) - heading)
+    return (np.abs(diff) <= half_fov) & (np.hypot(dx, dy) <= length)
+
+  def add_camera_view(self, ball_bearings: Sequence[float]) -> None:
+    """
+      Mark the camera cone as seen and add evidence for detected balls.
+
+      Args:
+          ball_bearings: Bearing of each detected ball relative to the
+              heading, positive to the left
+      """
+    cone = self._cone(self.heading, CAMERA_HALF_FOV, CAMERA_RANGE)
+    self.seen |= cone
+    self.ball[cone] *= BALL_DECAY
+    for bearing in ball_bearings:
+      self.ball[self._ray(self.heading + bearing, CAMERA_RANGE)] += BALL_HIT
+
+  def ball_caught(self, radius: float = CAMERA_RANGE / 2) -> None:
+    """Drop ball evidence around the robot after a catch."""
+    near = np.hypot(self._cx - self.x, self._cy - self.y) <= radius
+    self.ball[near] = 0
+
+  def free_distance(self,
+                    angle: float,
+                    length: float,
+                    observed: bool = False) -> float:
+    """
+      Distance from the robot to the first blocking cell along angle.
+
+      Args:
+          angle: Direction of the ray
+          length: Length of the ray, returned when nothing blocks it
+          observed: Also block at cells no ultrasonic ray has marked free,
+              otherwise only occupied cells block
+      """
+    steps = np.arange(0.0, length, self.cell / 2)
+    ix, iy = self._index(self.x + steps * math.cos(angle),
+                         self.y + steps * math.sin(angle))
+    values = self.log_odds[ix, iy]
+    if observed:
+      # Cells off the map are never observed either
+      blocked = np.append(np.flatnonzero(values >= 0.0), len(ix))
+    else:
+      blocked = np.flatnonzero(values > OCCUPIED_LOG_ODDS)
+    if len(blocked) and blocked[0] < len(steps):
+      return float(steps[blocked[0]])
+    return length
+
+  def plan(self) -> tuple[float, bool]:
+    """
+      Choose the next search move.
+
+      Returns:
+          tuple[float, bool]: Degrees to turn (positive left) and whether to
+              step forward afterwards
+      """
+    turns = range(-135, 181, 45)
+    unseen = ~self.seen & (self.log_odds <= OCCUPIED_LOG_ODDS)
+    best_score = 0.0
+    best_turn = None
+    for turn in turns:
+      heading = self.heading + math.radians(turn)
+      reach = self.free_distance(heading, CAMERA_RANGE)
+      cone = self._cone(heading, CAMERA_HALF_FOV, reach)
+      score = (np.count_nonzero(cone & unseen) +
+               BALL_WEIGHT * float(self.ball[cone].sum()) -
+               TURN_COST * abs(turn))
+      if score > best_score:
+        best_score, best_turn = score, float(turn)
+    if best_turn is not None and best_turn != 0.0:
+      return best_turn, False
+    # Nothing new within camera range: head for the most open direction
+    if best_turn is None:
+      best_turn = float(
+          max(turns,
+              key=lambda turn: self.free_distance(
+                  self.heading + math.radians(turn), ULTRASONIC_MAX_RANGE) -
+              TURN_COST * abs(turn)))
+    # Only step into cells the ultrasonic sensors have seen free
+    heading = self.heading + math.radians(best_turn)
+    need = FORWARD_CLEAR + FORWARD_STEP
+    if self.free_distance(heading, need, observed=True) >= need:
+      return best_turn, True
+    # Blocked: fall back to the old fixed search rotation
+    return best_turn or -45.0, False
+
+
+def search_step(robot_map: RescueMap,
+                drive: Callable[[int, int, float], None],
+                read_ultrasonic: Callable[[], Sequence[float]],
+                turn_45_time: float,
+                turn_180_time: float,
+                forward_step_time: float) -> float:
+  """
+    Carry out one planned search move.
+
+    After the turn the heading is set to the planned one, as the turn times
+    are calibrated while dead reckoning assumes the 45 degree turn rate. The
+    forward step is only taken when a fresh front reading shows it clear.
+
+    Args:
+        robot_map: Map to plan on and keep up to date
+        drive: Sends (left, right) for the given seconds, then stops. Zero
+            seconds only stops, so pending motion is dead-reckoned
+        read_ultrasonic: Returns the L/F/R ultrasonic readings
+        turn_45_time: Time of a 45 degree turn
+        turn_180_time: Time of a 180 degree turn
+        forward_step_time: Time to drive FORWARD_STEP
+
+    Returns:
+        float: Degrees turned (positive left)
+    """
+  degrees, forward = robot_map.plan()
+  drive(1500, 1500, 0.0)
+  heading = robot_map.heading
+  if degrees:
+    slow, fast = SEARCH_TURN_SPEEDS
+    left, right = (slow, fast) if degrees > 0 else (fast, slow)
+    drive(left, right, turn_time(degrees, turn_45_time, turn_180_time))
+    robot_map.heading = wrap_angle(heading + math.radians(degrees))
+  if forward:
+    distances = read_ultrasonic()
+    robot_map.add_ultrasonic(distances)
+    front = distances[1] if len(distances) > 1 else ULTRASONIC_TIMEOUT
+    if FORWARD_CLEAR + FORWARD_STEP <= front < ULTRASONIC_TIMEOUT:
+      drive(FORWARD_STEP_SPEED, FORWARD_STEP_SPEED, forward_step_time)
+  return degrees
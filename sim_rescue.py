@@ -0,0 +1,187 @@
+"""
+2D rescue area simulator comparing blind rotation with the map planner.
+
+Silver balls are placed at random in a 120 x 90 cm area and the robot enters
+at the bottom wall. The camera sees balls within CAMERA_HALF_FOV and
+CAMERA_RANGE, the ultrasonic sensors measure the walls with noise and the
+wheels slip, so the map only has dead reckoning to go on, like on the robot.
+Some ultrasonic requests time out and return the sentinel of main.py.
+When a ball is visible the robot drives to it and spends CATCH_TIME catching
+it; otherwise it makes one search move:
+  blind: rotate by 45 degrees, as main.py did before the map
+  map:   rescue_map.search_step(), the search move of main.py
+
+  python sim_rescue.py --runs 50
+"""
+
+import argparse
+import math
+import random
+import statistics
+
+import numpy as np
+
+import rescue_map
+from rescue_map import RescueMap, wrap_angle
+
+AREA_WIDTH = 120  # cm
+AREA_HEIGHT = 90  # cm
+BALL_CNT = 3
+BALL_MARGIN = 10  # cm from the walls
+ROBOT_RADIUS = 8  # cm
+CATCH_DIST = 12  # cm from the robot center at which a ball is caught
+CATCH_TIME = 7.0  # s, catch_ball() sequence in main.py
+TURN_45_TIME = 0.5  # main.py
+TURN_180_TIME = 2.4  # main.py, slower per degree than TURN_45_TIME
+SIM_STEP = 0.05  # s
+APPROACH_STEP = 0.3  # s driven towards a visible ball per decision
+ULTRASONIC_NOISE = 1.0  # cm
+ULTRASONIC_TIMEOUT_RATE = 0.05  # Share of readings that time out
+WHEEL_SLIP = 0.08  # Relative speed error of each wheel
+TIME_LIMIT = 300.0  # s
+FORWARD_SPEED = 100 * rescue_map.SPEED_PER_UNIT  # cm/s at 1600
+FORWARD_STEP_TIME = rescue_map.FORWARD_STEP / FORWARD_SPEED
+
+
+class Arena:
+  """True robot pose, balls and sensors."""
+
+  def __init__(self, rng: random.Random):
+    self.rng = rng
+    self.x = AREA_WIDTH / 2
+    self.y = ROBOT_RADIUS
+    self.heading = math.pi / 2
+    self.balls = [(rng.uniform(BALL_MARGIN, AREA_WIDTH - BALL_MARGIN),
+                   rng.uniform(BALL_MARGIN, AREA_HEIGHT - BALL_MARGIN))
+                  for _ in range(BALL_CNT)]
+
+  def drive(self, left: float, right: float, duration: float,
+            robot_map: RescueMap) -> float:
+    """Apply motor values to the true pose and to the dead-reckoned map."""
+    elapsed = 0.0
+    while elapsed < duration - 1e-9:
+      dt = min(SIM_STEP, duration - elapsed)
+      robot_map.move(left, right, dt)
+      slip_l = 1 + self.rng.gauss(0, WHEEL_SLIP)
+      slip_r = 1 + self.rng.gauss(0, WHEEL_SLIP)
+      true_l = 1500 + (left - 1500) * slip_l
+      true_r = 1500 + (right - 1500) * slip_r
+      v = ((true_l + true_r) / 2 - 1500) * rescue_map.SPEED_PER_UNIT
+      omega = (true_r - true_l) * rescue_map.TURN_RATE_PER_UNIT
+      self.heading = wrap_angle(self.heading + omega * dt)
+      self.x = min(max(self.x + v * math.cos(self.heading) * dt, ROBOT_RADIUS),
+                   AREA_WIDTH - ROBOT_RADIUS)
+      self.y = min(max(self.y + v * math.sin(self.heading) * dt, ROBOT_RADIUS),
+                   AREA_HEIGHT - ROBOT_RADIUS)
+      elapsed += dt
+    return duration
+
+  def _wall_distance(self, angle: float) -> float:
+    dx, dy = math.cos(angle), math.sin(angle)
+    dists = []
+    if dx > 1e-9:
+      dists.append((AREA_WIDTH - self.x) / dx)
+    elif dx < -1e-9:
+      dists.append(-self.x / dx)
+    if dy > 1e-9:
+      dists.append((AREA_HEIGHT - self.y) / dy)
+    elif dy < -1e-9:
+      dists.append(-self.y / dy)
+    return min(dists)
+
+  def ultrasonic(self) -> list[float]:
+    if self.rng.random() < ULTRASONIC_TIMEOUT_RATE:
+      return [rescue_map.ULTRASONIC_TIMEOUT] * 3
+    ret = []
+    for offset in rescue_map.ULTRASONIC_ANGLES:
+      distance = self._wall_distance(self.heading + offset)
+      ret.append(max(0.0, distance + self.rng.gauss(0, ULTRASONIC_NOISE)))
+    return ret
+
+  def visible_balls(self) -> list[tuple[float, float]]:
+    """(bearing, distance) of each ball the camera sees."""
+    ret = []
+    for bx, by in self.balls:
+      distance = math.hypot(bx - self.x, by - self.y)
+      bearing = wrap_angle(math.atan2(by - self.y, bx - self.x) - self.heading)
+      if (abs(bearing) <= rescue_map.CAMERA_HALF_FOV and
+          distance <= rescue_map.CAMERA_RANGE):
+        ret.append((bearing, distance))
+    return ret
+
+  def catch(self) -> bool:
+    for ball in self.balls:
+      if math.hypot(ball[0] - self.x, ball[1] - self.y) <= CATCH_DIST:
+        self.balls.remove(ball)
+        return True
+    return False
+
+
+def turn(arena: Arena, robot_map: RescueMap, degrees: float) -> float:
+  """Rotate in place for rescue_map.turn_time(), positive to the left."""
+  duration = rescue_map.turn_time(degrees, TURN_45_TIME, TURN_180_TIME)
+  if degrees > 0:
+    return arena.drive(1250, 1750, duration, robot_map)
+  return arena.drive(1750, 1250, duration, robot_map)
+
+
+def run(strategy: str, seed: int) -> tuple[int, float]:
+  """
+    Collect balls with one strategy.
+
+    Args:
+        strategy: "blind" or "map"
+        seed: Seed of ball placement and sensor noise
+
+    Returns:
+        tuple[int, float]: Balls collected and the time used
+  """
+  rng = random.Random(seed)
+  arena = Arena(rng)
+  robot_map = RescueMap()
+  t = 0.0
+  collected = 0
+
+  def drive(left: int, right: int, duration: float) -> None:
+    nonlocal t
+    t += arena.drive(left, right, duration, robot_map)
+
+  while arena.balls and t < TIME_LIMIT:
+    robot_map.add_ultrasonic(arena.ultrasonic())
+    visible = arena.visible_balls()
+    robot_map.add_camera_view([bearing for bearing, _ in visible])
+    if visible:
+      bearing, distance = min(visible, key=lambda ball: ball[1])
+      if abs(bearing) > math.radians(10):
+        t += turn(arena, robot_map, math.degrees(bearing))
+      t += arena.drive(1600, 1600,
+                       min(APPROACH_STEP, distance / FORWARD_SPEED), robot_map)
+      if arena.catch():
+        robot_map.ball_caught()
+        collected += 1
+        t += CATCH_TIME
+    elif strategy == "blind":
+      t += turn(arena, robot_map, -45)
+    else:
+      rescue_map.search_step(robot_map, drive, arena.ultrasonic, TURN_45_TIME,
+                             TURN_180_TIME, FORWARD_STEP_TIME)
+  return collected, t
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("--runs", type=int, default=30)
+  args = parser.parse_args()
+  print(f"{'strategy':>8} {'balls':>6} {'done':>5} {'median[s]':>9} "
+        f"{'mean[s]':>8}")
+  for strategy in ("blind", "map"):
+    results = [run(strategy, seed) for seed in range(args.runs)]
+    balls = np.mean([collected for collected, _ in results])
+    done = sum(collected == BALL_CNT for collected, _ in results)
+    times = [t for _, t in results]
+    print(f"{strategy:>8} {balls:>6.2f} {done:>5} "
+          f"{statistics.median(times):>9.1f} {np.mean(times):>8.1f}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,105 @@
+"""
+Line trace steering controller.
+
+Turns the line slope of each camera frame into left/right motor values with
+P/I/D terms on the line angle error and a look-ahead feedforward from the
+trend of that error. dt comes from the frame timestamps, and speed and
+steering are computed once per frame; control ticks that see the same frame
+again get the same command.
+"""
+
+import math
+from typing import Optional
+
+import decision
+
+STEERING_INTEGRAL_LIMIT = 0.5  # rad * s
+STEERING_TREND_ALPHA = 0.3  # EMA factor of the error trend
+STEERING_MAX_DT = 0.2  # Longer gaps (line lost, camera stall) reset D/I
+
+
+class SteeringController:
+  """PID + feedforward steering on the line angle from the camera."""
+
+  def __init__(self,
+               kp: float,
+               ki: float = 0.0,
+               kd: float = 0.0,
+               lookahead: float = 0.0,
+               default_speed: int = 1700,
+               speed_gain: float = decision.SPEED_CURVE_GAIN):
+    """
+      Args:
+          kp: Proportional gain, same unit as COMPUTING_P
+          ki: Integral gain on error * seconds
+          kd: Derivative gain on error / seconds
+          lookahead: Seconds the error trend is extrapolated for feedforward
+          default_speed: Speed used when driving straight
+          speed_gain: How strongly the speed drops with the line angle
+      """
+    self.kp = kp
+    self.ki = ki
+    self.kd = kd
+    self.lookahead = lookahead
+    self.default_speed = default_speed
+    self.speed_gain = speed_gain
+    self.reset()
+
+  def reset(self) -> None:
+    """Forget the error history, e.g. after a turn or when the line is lost."""
+    self._timestamp: Optional[float] = None
+    self._error = 0.0
+    self._integral = 0.0
+    self._trend = 0.0
+    self._command: Optional[tuple[int, int]] = None
+
+  def update(self, slope: Optional[float], timestamp: float) -> tuple[int, int]:
+    """
+      Compute motor values for one camera frame.
+
+      Args:
+          slope: Line slope of the frame, None when no line is visible
+              (the history is reset and the robot drives straight slightly
+              slower)
+          timestamp: Capture time of the frame
+
+      Returns:
+          tuple[int, int]: Left and right motor values
+      """
+    if slope is None:
+      self.reset()
+      speed = decision.compute_default_speed(
+          None, self.default_speed,
+          self.speed_gain) - decision.LINE_LOST_SLOWDOWN
+      return speed, speed
+    if timestamp == self._timestamp and self._command is not None:
+      return self._command
+
+    # Positive error: the line leans left, so the robot turns left
+    error = decision.line_angle(slope) - math.pi / 2
+    derivative = 0.0
+    if self._timestamp is not None:
+      dt = timestamp - self._timestamp
+      if 0 < dt <= STEERING_MAX_DT:
+        derivative = (error - self._error) / dt
+        self._trend += STEERING_TREND_ALPHA * (derivative - self._trend)
+        self._integral = decision.fix_to_range(self._integral + error * dt,
+                                               -STEERING_INTEGRAL_LIMIT,
+                                               STEERING_INTEGRAL_LIMIT)
+      else:
+        self._trend = 0.0
+        self._integral = 0.0
+    self._timestamp = timestamp
+    self._error = error
+
+    look_ahead_error = error + self._trend * self.lookahead
+    moving = (decision.compute_moving_value(look_ahead_error, self.kp) +
+              self.ki * self._integral + self.kd * derivative)
+    speed = decision.compute_default_speed(slope, self.default_speed,
+                                           self.speed_gain)
+    self._command = (
+        int(decision.fix_to_range(speed - moving, decision.MOTOR_MIN,
+                                  decision.MOTOR_MAX)),
+        int(decision.fix_to_range(speed + moving, decision.MOTOR_MIN,
+                                  decision.MOTOR_MAX)))
+    return self._command
@@ -0,0 +1,434 @@
+"""
+Offline parameter sweep over recorded traces.
+
+Replays traces written by recording.TraceRecorder through the pure decision
+logic in decision.py for every combination of the given parameters, using a
+process pool, and ranks the combinations.
+
+Example:
+  python sweep.py traces/*.npz --grid COMPUTING_P=200:600:50 \\
+      --grid default_speed=1600,1700,1800 --rank pareto --top 20
+
+Line trace (lt_*) and rescue (rs_*) commands are scored separately. The
+replay is open-loop: the recorded frames do not react to the commands, so
+it cannot measure how long reaching a ball would take with other
+parameters. rs_approach_speed, the mean commanded forward speed while
+approaching a ball, is reported instead. The rescue replay follows the
+class the robot was searching for on each tick (valid_class in the trace).
+
+Smoothness alone is won by the smallest gains, so lt_tracking runs each
+steering combination closed-loop on the robot model of bench_steering.py and
+reports its RMS line distance in mm; rs_steering, the mean |L - R| while
+approaching, is the rescue counterpart to rs_smoothness. --rank pareto sorts by Pareto front over
+PARETO_METRICS, breaking ties by lt_tracking. Combinations whose commands are
+clamped to the motor range more often than --max-saturation are marked and
+ranked last, as clamped output looks smooth without following the input.
+"""
+
+import argparse
+import concurrent.futures
+import itertools
+import math
+import os
+from typing import Optional, Sequence
+
+import numpy as np
+
+import bench_steering
+import decision
+from recording import load_trace
+from steering import SteeringController
+
+# Defaults for parameters that are not swept (values used by main.py).
+# COMPUTING_P lives in modules.settings and has to be given with --grid.
+DEFAULT_PARAMS = {
+    "COMPUTING_P": None,
+    "default_speed": 1700,
+    "SPEED_CURVE_GAIN": decision.SPEED_CURVE_GAIN,
+    "STEERING_KI": 0.0,
+    "STEERING_KD": 0.0,
+    "STEERING_LOOKAHEAD": 0.0,
+    "P": 0.4,
+    "AP": 1,
+    "WP": 0.3,
+    "BALL_CATCH_SIZE": 140000,
+}
+
+# Metrics and whether a larger value is better
+METRICS = {
+    "lt_tracking": False,
+    "lt_smoothness": False,
+    "lt_saturation": False,
+    "lt_speed": True,
+    "rs_smoothness": False,
+    "rs_saturation": False,
+    "rs_approach_speed": True,
+    "rs_steering": True,
+}
+MAX_SATURATION = 0.05
+PARETO_METRICS = ("lt_tracking", "lt_smoothness", "rs_smoothness",
+                  "rs_approach_speed", "rs_steering")
+
+FEATURE_VERSION = 3
+BALL_CLASSES = (0, decision.SILVER_BALL_CLASS)  # Black and silver balls
+CAGE_CLASSES = (2, 3)  # Green and red cages
+
+_features: list[dict[str, np.ndarray]] = []
+
+
+def _rescue_targets(trace: dict[str, np.ndarray],
+                    frames: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+  """
+    Target of each rescue frame as main.py selects it.
+
+    Returns:
+        tuple: Targets (N, 5) (NaN if none) and the class searched for after
+            the selection (N,), -1 when the trace did not record it
+    """
+  targets = np.full((len(frames), 5), np.nan)
+  classes = trace["valid_class"][frames].astype(np.int64)
+  grouped: dict[int, list] = {}
+  for frame, box in zip(trace["box_frame"], trace["boxes"]):
+    grouped.setdefault(int(frame), []).append(
+        (int(box[0]), *map(float, box[1:])))
+  for i, frame in enumerate(frames.tolist()):
+    cls = int(classes[i])
+    if cls < 0 or frame not in grouped:
+      continue
+    # A seen silver ball replaces the searched class unless one is held
+    target, _, valid_classes, _ = decision.find_best_target(
+        grouped[frame], trace["image_size"][frame][0], [cls],
+        cls in CAGE_CLASSES)
+    classes[i] = valid_classes[0]
+    if target is not None:
+      targets[i] = target
+  return targets, classes
+
+
+def extract_features(trace: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+  """Compute the parameter-independent per-tick inputs of one trace."""
+  is_rescue = trace["is_rescue"].astype(bool)
+  rescue_frames = np.flatnonzero(is_rescue)
+  if np.any(trace["valid_class"][rescue_frames] < 0):
+    print("warning: trace has rescue ticks without valid_class, "
+          "they are skipped (record the trace again)")
+  targets, classes = _rescue_targets(trace, rescue_frames)
+  return {
+      # The robot steers on the frame time, not the tick time
+      "lt_t": trace["frame_t"][~is_rescue],
+      "lt_slope": trace["slope"][~is_rescue],
+      "rs_t": trace["t"][rescue_frames],
+      "rs_image_size": trace["image_size"][rescue_frames].astype(np.float64),
+      "rs_target": targets,
+      "rs_class": classes,
+  }
+
+
+def load_features(trace_path: str) -> dict[str, np.ndarray]:
+  """
+    Load cached features of a trace memory-mapped, building the cache if needed.
+
+    npz members cannot be memory-mapped, so the cache is a directory of .npy
+    files next to the trace.
+
+    Args:
+        trace_path: Path of a trace written by TraceRecorder
+
+    Returns:
+        dict[str, np.ndarray]: Read-only memory-mapped feature arrays
+    """
+  cache_dir = f"{trace_path}.features.v{FEATURE_VERSION}"
+  stamp = os.path.join(cache_dir, "mtime")
+  mtime = str(os.path.getmtime(trace_path))
+  if os.path.exists(stamp):
+    with open(stamp) as f:
+      is_stale = f.read() != mtime
+  else:
+    is_stale = True
+  if is_stale:
+    os.makedirs(cache_dir, exist_ok=True)
+    for name, array in extract_features(load_trace(trace_path)).items():
+      np.save(os.path.join(cache_dir, f"{name}.npy"), array)
+    with open(stamp, "w") as f:
+      f.write(mtime)
+  return {
+      name[:-4]: np.load(os.path.join(cache_dir, name), mmap_mode="r")
+      for name in os.listdir(cache_dir)
+      if name.endswith(".npy")
+  }
+
+
+def _init_worker(trace_paths: list[str]) -> None:
+  global _features
+  _features = [load_features(path) for path in trace_paths]
+
+
+def replay_linetrace(features: dict[str, np.ndarray],
+                     params: dict) -> np.ndarray:
+  """Motor commands (N, 2) for each line trace tick."""
+  controller = SteeringController(params["COMPUTING_P"], params["STEERING_KI"],
+                                  params["STEERING_KD"],
+                                  params["STEERING_LOOKAHEAD"],
+                                  params["default_speed"],
+                                  params["SPEED_CURVE_GAIN"])
+  commands = []
+  for t, slope in zip(features["lt_t"].tolist(),
+                      features["lt_slope"].tolist()):
+    commands.append(controller.update(None if math.isnan(slope) else slope, t))
+  return np.asarray(commands, dtype=np.float64).reshape(-1, 2)
+
+
+def replay_rescue(features: dict[str, np.ndarray],
+                  params: dict) -> tuple[np.ndarray, np.ndarray]:
+  """
+    Replay rescue ticks towards the recorded ball or cage class.
+
+    Ticks that would catch or release do not drive and are left out.
+
+    Args:
+        features: Features from load_features
+        params: One parameter combination
+
+    Returns:
+        tuple: Motor commands (N, 2) while driving, and whether each of them
+            approaches a ball (N,)
+    """
+  commands = []
+  is_ball = []
+  for row, cls, (width, height) in zip(features["rs_target"],
+                                       features["rs_class"].tolist(),
+                                       features["rs_image_size"]):
+    if np.isnan(row[0]):
+      continue
+    target = decision.Target(*row.tolist())
+    if cls in BALL_CLASSES:
+      command = decision.compute_ball_approach(target, width, height,
+                                               params["P"], params["AP"],
+                                               params["BALL_CATCH_SIZE"])
+      if command.catch:
+        continue
+    elif cls in CAGE_CLASSES:
+      command = decision.compute_cage_approach(target, params["WP"],
+                                               params["BALL_CATCH_SIZE"])
+      if command.release:
+        continue
+    else:
+      continue
+    commands.append((command.left, command.right))
+    is_ball.append(cls in BALL_CLASSES)
+  return (np.asarray(commands, dtype=np.float64).reshape(-1, 2),
+          np.asarray(is_ball, dtype=bool))
+
+
+def closed_loop_tracking(params: dict) -> float:
+  """RMS line distance (mm) of the steering on bench_steering's robot model."""
+  controller = SteeringController(params["COMPUTING_P"], params["STEERING_KI"],
+                                  params["STEERING_KD"],
+                                  params["STEERING_LOOKAHEAD"],
+                                  params["default_speed"],
+                                  params["SPEED_CURVE_GAIN"])
+  return bench_steering.simulate(controller)["rms_error"] * 1000
+
+
+def _mean(arrays: list[np.ndarray]) -> float:
+  values = np.concatenate(arrays) if arrays else np.zeros(0)
+  return float(values.mean()) if len(values) else 0.0
+
+
+def _command_metrics(commands: list[np.ndarray]) -> tuple[float, float, float]:
+  """Smoothness, saturation and mean forward speed of command sequences."""
+  diffs = []
+  saturated = []
+  speeds = []
+  for sequence in commands:
+    if not len(sequence):
+      continue
+    diffs.append(np.abs(np.diff(sequence[:, 0] - sequence[:, 1])))
+    saturated.append(((sequence <= decision.MOTOR_MIN) |
+                      (sequence >= decision.MOTOR_MAX)).ravel())
+    speeds.append(sequence.mean(axis=1) - decision.MOTOR_NEUTRAL)
+  return _mean(diffs), _mean(saturated), _mean(speeds)
+
+
+def score(params: dict) -> dict:
+  """Replay every loaded trace with params and compute the metrics."""
+  lt_commands = []
+  rs_commands = []
+  ball_commands = []
+  for features in _features:
+    lt_commands.append(replay_linetrace(features, params))
+    commands, is_ball = replay_rescue(features, params)
+    rs_commands.append(commands)
+    ball_commands.append(commands[is_ball])
+  lt_smoothness, lt_saturation, lt_speed = _command_metrics(lt_commands)
+  rs_smoothness, rs_saturation, _ = _command_metrics(rs_commands)
+  _, _, rs_approach_speed = _command_metrics(ball_commands)
+  return {
+      "params": params,
+      "lt_tracking": closed_loop_tracking(params),
+      "lt_smoothness": lt_smoothness,
+      "lt_saturation": lt_saturation,
+      "lt_speed": lt_speed,
+      "rs_smoothness": rs_smoothness,
+      "rs_saturation": rs_saturation,
+      "rs_approach_speed": rs_approach_speed,
+      "rs_steering": _mean([
+          np.abs(commands[:, 0] - commands[:, 1]) for commands in rs_commands
+      ]),
+  }
+
+
+def is_saturated(result: dict, metric: str,
+                 max_saturation: float = MAX_SATURATION) -> bool:
+  """Whether the commands scored by metric are clamped too often."""
+  if metric == "pareto":
+    return max(result["lt_saturation"],
+               result["rs_saturation"]) > max_saturation
+  return result[f"{metric[:2]}_saturation"] > max_saturation
+
+
+def pareto_fronts(results: list[dict],
+                  metrics: Sequence[str] = PARETO_METRICS) -> list[int]:
+  """Pareto front index of each result (0 is not dominated by any other)."""
+  # Costs to minimize, one row per result
+  costs = np.array([[-r[m] if METRICS[m] else r[m]
+                     for m in metrics]
+                    for r in results],
+                   dtype=np.float64).reshape(len(results), len(metrics))
+  fronts = [-1] * len(results)
+  remaining = np.arange(len(results))
+  front = 0
+  while len(remaining):
+    sub = costs[remaining]
+    dominated = np.array([
+        np.any(np.all(sub <= row, axis=1) & np.any(sub < row, axis=1))
+        for row in sub
+    ])
+    for i in remaining[~dominated]:
+      fronts[i] = front
+    remaining = remaining[dominated]
+    front += 1
+  return fronts
+
+
+def _score_chunk(chunk: list[dict]) -> list[dict]:
+  return [score(params) for params in chunk]
+
+
+def parse_grid_value(text: str) -> list[float]:
+  """Parse "a,b,c" or an inclusive "start:stop:step" range."""
+  if ":" in text:
+    start, stop, step = map(float, text.split(":"))
+    count = int(math.floor((stop - start) / step + 1e-9)) + 1
+    return [start + i * step for i in range(count)]
+  return [float(value) for value in text.split(",")]
+
+
+def build_combinations(grid: dict[str, list[float]]) -> list[dict]:
+  """All parameter combinations, non-swept parameters taking DEFAULT_PARAMS."""
+  names = list(grid)
+  combinations = []
+  for values in itertools.product(*(grid[name] for name in names)):
+    params = dict(DEFAULT_PARAMS)
+    params.update(zip(names, values))
+    combinations.append(params)
+  return combinations
+
+
+def run_sweep(trace_paths: list[str],
+              combinations: list[dict],
+              workers: Optional[int] = None,
+              chunk_size: int = 16) -> list[dict]:
+  """
+    Score every combination over the traces in a process pool.
+
+    Args:
+        trace_paths: Traces written by TraceRecorder
+        combinations: Parameter dicts from build_combinations
+        workers: Number of worker processes (CPU count if None)
+        chunk_size: Combinations sent to a worker at once
+
+    Returns:
+        list[dict]: Metrics for each combination, in input order
+    """
+  # Build caches once here so workers only memory-map them
+  for path in trace_paths:
+    load_features(path)
+  chunks = [
+      combinations[i:i + chunk_size]
+      for i in range(0, len(combinations), chunk_size)
+  ]
+  results = []
+  with concurrent.futures.ProcessPoolExecutor(
+      max_workers=workers, initializer=_init_worker,
+      initargs=(trace_paths,)) as executor:
+    for chunk_results in executor.map(_score_chunk, chunks):
+      results.extend(chunk_results)
+  return results
+
+
+def rank(results: list[dict],
+         metric: str,
+         max_saturation: float = MAX_SATURATION) -> list[dict]:
+  """Sort results best first by metric or "pareto", too saturated ones last."""
+  if metric == "pareto":
+    fronts = pareto_fronts(results)
+    order = sorted(range(len(results)),
+                   key=lambda i: (is_saturated(results[i], metric,
+                                               max_saturation), fronts[i],
+                                  results[i]["lt_tracking"]))
+    return [results[i] for i in order]
+  sign = -1 if METRICS[metric] else 1
+  return sorted(results,
+                key=lambda r:
+                (is_saturated(r, metric, max_saturation), sign * r[metric]))
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+  parser.add_argument("traces", nargs="+", help="Recorded trace npz files")
+  parser.add_argument("--grid",
+                      action="append",
+                      default=[],
+                      metavar="NAME=VALUES",
+                      help="Swept parameter, VALUES is a,b,c or start:stop:step")
+  parser.add_argument("--rank",
+                      choices=[*METRICS, "pareto"],
+                      default="pareto",
+                      help="Metric to rank by, or pareto over "
+                      f"{', '.join(PARETO_METRICS)}; open-loop replay "
+                      "cannot measure time to target")
+  parser.add_argument("--max-saturation",
+                      type=float,
+                      default=MAX_SATURATION,
+                      help="Share of clamped motor values above which a "
+                      "combination is marked and ranked last")
+  parser.add_argument("--top", type=int, default=10)
+  parser.add_argument("--workers", type=int, default=None)
+  args = parser.parse_args()
+
+  grid = {}
+  for item in args.grid:
+    name, _, values = item.partition("=")
+    if name not in DEFAULT_PARAMS:
+      parser.error(f"Unknown parameter {name}, choose from "
+                   f"{', '.join(DEFAULT_PARAMS)}")
+    grid[name] = parse_grid_value(values)
+  if "COMPUTING_P" not in grid:
+    parser.error("COMPUTING_P has no default, give it with --grid")
+
+  combinations = build_combinations(grid)
+  print(f"Sweeping {len(combinations)} combinations over "
+        f"{len(args.traces)} traces")
+  results = rank(run_sweep(args.traces, combinations, args.workers),
+                 args.rank, args.max_saturation)
+  for result in results[:args.top]:
+    swept = " ".join(f"{name}={result['params'][name]:g}" for name in grid)
+    metrics = " ".join(f"{name}={result[name]:.3f}" for name in METRICS)
+    flag = (" | SATURATED"
+            if is_saturated(result, args.rank, args.max_saturation) else "")
+    print(f"{swept} | {metrics}{flag}")
+
+
+if __name__ == "__main__":
+  main()
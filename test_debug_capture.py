@@ -0,0 +1,106 @@
+"""
+Tests of debug_capture.DebugCapture sampling, event and drop counters.
+
+Images are not written: debug_capture._imwrite is replaced with a fake that
+records the paths. modules.log is stubbed when the modules library is absent.
+"""
+
+import logging
+import sys
+import types
+
+import numpy as np
+import pytest
+
+try:
+  import modules.log  # noqa: F401
+except ImportError:
+  _log = types.ModuleType("modules.log")
+  _log.get_logger = lambda: logging.getLogger("debug_capture_test")
+  sys.modules.setdefault("modules", types.ModuleType("modules")).log = _log
+  sys.modules["modules.log"] = _log
+
+import debug_capture
+from debug_capture import DebugCapture
+
+IMAGE = np.zeros((4, 4, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def written(monkeypatch):
+  paths = []
+
+  def fake_imwrite(path, image, *args):
+    paths.append(path)
+    return True
+
+  monkeypatch.setattr(debug_capture, "_imwrite", fake_imwrite)
+  return paths
+
+
+def test_every_nth_sampling(tmp_path, written):
+  capture = DebugCapture(str(tmp_path), workers=1, every_nth=3)
+  for i in range(9):
+    capture.submit("original", IMAGE, float(i))
+  capture.close()
+  assert sorted(written) == [
+      str(tmp_path / f"{t:.3f}_original.jpg") for t in (2, 5, 8)
+  ]
+  stats = capture.stats()
+  assert (stats["submitted"], stats["skipped"], stats["written"]) == (3, 6, 3)
+
+
+def test_event_frames_per_stream(tmp_path, written):
+  capture = DebugCapture(str(tmp_path), workers=1, every_nth=0,
+                         event_frames=2)
+  capture.submit("a", IMAGE, 0.0)
+  capture.submit("b", IMAGE, 0.0)
+  capture.mark_event("green_mark")
+  for t in (1.0, 2.0, 3.0):
+    capture.submit("a", IMAGE, t)
+    capture.submit("b", IMAGE, t)
+  capture.close()
+  assert sorted(written) == sorted(
+      str(tmp_path / f"{t:.3f}_{name}_green_mark.jpg")
+      for t in (1.0, 2.0)
+      for name in ("a", "b"))
+  assert capture.stats()["skipped"] == 4
+
+
+def test_sampled_frames_are_dropped_before_events(tmp_path, written):
+  # No workers: the queue only fills up
+  capture = DebugCapture(str(tmp_path), queue_size=2, workers=0, every_nth=1,
+                         event_frames=2)
+  assert capture.submit("a", IMAGE, 0.0)
+  assert capture.submit("a", IMAGE, 1.0)
+  capture.mark_event("rescue_catch")
+  assert capture.submit("a", IMAGE, 2.0)
+  assert capture.submit("a", IMAGE, 3.0)
+  # Queue full of events: a sampled frame is refused
+  assert not capture.submit("a", IMAGE, 4.0)
+  queued = [entry[0] for entry in capture._queue]
+  assert queued == [
+      str(tmp_path / f"{t:.3f}_a_rescue_catch.jpg") for t in (2.0, 3.0)
+  ]
+  stats = capture.stats()
+  assert (stats["dropped"], stats["dropped_events"]) == (3, 0)
+
+
+def test_events_drop_oldest_event_when_full(tmp_path, written):
+  capture = DebugCapture(str(tmp_path), queue_size=2, workers=0, every_nth=0,
+                         event_frames=3)
+  capture.submit("a", IMAGE, 0.0)
+  capture.mark_event("green_mark")
+  for t in (1.0, 2.0, 3.0):
+    assert capture.submit("a", IMAGE, t)
+  assert [entry[0] for entry in capture._queue] == [
+      str(tmp_path / f"{t:.3f}_a_green_mark.jpg") for t in (2.0, 3.0)
+  ]
+  assert capture.stats()["dropped_events"] == 1
+
+
+def test_close_capture_without_capture(monkeypatch, tmp_path):
+  monkeypatch.setattr(debug_capture, "_capture", None)
+  monkeypatch.chdir(tmp_path)
+  assert debug_capture.close_capture() is None
+  assert not (tmp_path / "bin").exists()
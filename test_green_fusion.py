@@ -0,0 +1,120 @@
+"""
+Tests of green_fusion.GreenMarkFusion on short intersection sequences.
+
+Each sequence is a list of (timestamp, marks) camera frames at 30 fps with
+marks given as (x, y, green_black_detected entry) in a 120 px high image.
+The replay tests record them through TraceRecorder first, with several
+control ticks per camera frame like on the robot.
+"""
+
+import pytest
+
+import decision
+from green_fusion import GreenMarkFusion, replay
+from recording import TraceRecorder, load_trace
+
+IMAGE_HEIGHT = 120
+FRAME_DT = 1 / 30
+LEFT = (0, 1, 1, 0)
+RIGHT = (0, 1, 0, 1)
+
+
+def run(frames):
+  """Feed frames to a fresh fusion, return [(frame index, turn)] and it."""
+  fusion = GreenMarkFusion(IMAGE_HEIGHT)
+  turns = []
+  for i, (timestamp, marks) in enumerate(frames):
+    turn = fusion.update(timestamp, [mark[:2] for mark in marks],
+                         [list(mark[2]) for mark in marks])
+    if turn is not None:
+      turns.append((i, turn))
+  return turns, fusion
+
+
+def approach(marks_at, frames=15):
+  """Frames whose marks are marks_at(i) for frame i."""
+  return [(i * FRAME_DT, marks_at(i)) for i in range(frames)]
+
+
+def test_turn_fires_when_mark_reaches_turn_line():
+  # y = 20 + 8 * i reaches 0.9 * 120 = 108 on frame 11
+  turns, _ = run(approach(lambda i: [(80, 20 + 8 * i, LEFT)]))
+  assert turns[0] == (11, decision.TURN_LEFT)
+
+
+def test_uturn_with_marks_on_both_sides():
+  turns, _ = run(
+      approach(lambda i: [(50, 20 + 8 * i, LEFT), (110, 20 + 8 * i, RIGHT)]))
+  assert turns[0] == (11, decision.TURN_UTURN)
+
+
+def test_mark_leaving_frame_early_is_extrapolated():
+  # Last seen at y = 70 on frame 5, then extrapolated past 108
+  turns, _ = run(
+      approach(lambda i: [(80, 30 + 8 * i, LEFT)] if i < 6 else []))
+  assert turns == [(10, decision.TURN_LEFT)]
+
+
+def test_confirmed_mark_lost_past_gate_still_turns():
+  # Slow marks at y 70 -> 82 vanish before reaching the turn line
+  turns, _ = run(approach(lambda i: [(80, 70 + 3 * i, LEFT)] if i < 5 else []))
+  assert turns == [(9, decision.TURN_LEFT)]
+
+
+def test_stationary_mark_lost_past_gate_turns_on_expiry():
+  turns, _ = run(approach(lambda i: [(80, 70, RIGHT)] if i < 5 else []))
+  assert turns == [(9, decision.TURN_RIGHT)]
+
+
+def test_single_frame_false_detection_is_ignored():
+  turns, fusion = run(approach(lambda i: [(80, 100, RIGHT)] if i == 3 else []))
+  assert turns == []
+  assert fusion.pending is None
+
+
+def test_repeated_timestamps_vote_once():
+  turns, fusion = run([(0.0, [(80, 110, LEFT)])] * 6)
+  assert turns == []
+  assert fusion.pending is None
+
+
+def test_time_gap_drops_confirmed_marks():
+  frames = [(i * FRAME_DT, [(80, 52, LEFT)]) for i in range(3)]
+  turns, fusion = run(frames + [(10.0, [])])
+  assert turns == []
+  assert fusion.pending is None
+
+
+def record(path, frames, ticks_per_frame=3):
+  """Record frames through TraceRecorder like main.py, several ticks each."""
+  recorder = TraceRecorder(str(path))
+  tick = 0.0
+  for timestamp, marks in frames:
+    for _ in range(ticks_per_frame):
+      tick += 0.01
+      recorder.add_linetrace(tick, 0.0, [mark[:2] for mark in marks],
+                             [list(mark[2]) for mark in marks], timestamp)
+  recorder.save()
+  return load_trace(str(path))
+
+
+def test_replay_of_recorded_intersection(tmp_path):
+  # Ends with the turn, after which the robot no longer sees the marks
+  trace = record(tmp_path / "trace.npz",
+                 approach(lambda i: [(80, 20 + 8 * i, LEFT)], frames=12))
+  assert trace["marks"].shape == (36, 6)
+  assert trace["marks"][0].tolist() == [80, 20, *LEFT]
+  decisions = replay(trace, IMAGE_HEIGHT)
+  # The old gate fires once y passes 60 (frame 6), the fusion at 108
+  assert decisions == [
+      (pytest.approx(6 * FRAME_DT), "single", decision.TURN_LEFT),
+      (pytest.approx(11 * FRAME_DT), "fused", decision.TURN_LEFT),
+  ]
+
+
+def test_replay_votes_once_per_recorded_frame(tmp_path):
+  # One false detection repeated over the three ticks of its frame
+  trace = record(tmp_path / "trace.npz",
+                 approach(lambda i: [(80, 100, RIGHT)] if i == 3 else []))
+  decisions = replay(trace, IMAGE_HEIGHT)
+  assert [kind for _, kind, _ in decisions] == ["single"]